@@ -2,9 +2,11 @@
 APPLICATION:    Website Words
 DEVELOPED BY:   David Blessent
 REPOSITORY:     github.com/almondhouse27/website-words
-COMMAND:        
+COMMAND:        python src/WebsiteWords.py [--resume] [--shard-index I --shard-count N] [--merge --shard-count N]
+                                           [--depth D --max-pages P]
 PRODUCES:       produces timestamped json file and csv files in data/output/
                 word-data.csv, site-data.csv, log-data.csv, diagnostic-summary.json
+                and adds each run's word-data to data/index/word-index.sqlite, see wordindex.py
 
 PURPOSE:        Website Words is a web scraper that processes a list of URLs from data/input/url-list.csv,
                 sending HTTP requests and parsing the HTML responses to generate four timestamped files
@@ -24,106 +26,161 @@ PURPOSE:        Website Words is a web scraper that processes a list of URLs fro
                         provides runtime analytics, including duration, file sizes, request outcomes,
                         log level data, and descriptive statistics of the word-data.csv dataset.
 """
-import time
+import argparse
 import logging as log
+import fetchcache
+import metrics
 import robots
 from diagnostics import Diagnostics
-from scraper import scrapeWebsite
-from logparser import executeLogParser     
-from utility import \
-    setupProjectStructure, \
-    readDataInput, \
-    writeWordData, \
-    writeSiteData, \
-    sortDataOutput
-
-HEADERS = {'User-Agent': 'Mozilla/5.0'}
-ROBOT_RETRY = 3
-DIRECTORIES = ['data', 'data/input', 'data/output']
+from frontier import CRAWL_DEPTH, DOMAIN_PAGE_BUDGET
+from inputreader import readUrlInput
+from journal import JOURNAL_FILE
+from neardup import SIGNATURE_FILE
+from pipeline import Crawler, closeCaches
+from robotcache import ROBOTS_CACHE_FILE
+from shards import mergeShards, selectShard, shardFile, shardOutput, writeEventMetrics
+from logparser import configureLogging
+from utility import setupProjectStructure
+from wordindex import indexRun
+
+FETCH_CACHE = True      # conditional re-crawl, reuses results of pages unchanged since the last run
+WORD_INDEX = True       # adds each run's word-data to data/index/word-index.sqlite, see wordindex.py
+DIRECTORIES = ['data', 'data/input', 'data/output', 'data/cache']
 LOG_OUTPUT = 'data/output'
 LOG_FILE = 'logs/scraper.log'
+LOG_FORMAT = 'json'     # 'json' lines with module/url/elapsed_ms fields, or 'text'
 INPUT_FILE = 'data/input/url-list.csv'
+# crawl settings (workers, host delay, output formats, word normalization...) are in pipeline.py
 
 
-log.basicConfig(
-        filename=LOG_FILE,
-        level=log.INFO, 
-        format='%(asctime)s - %(levelname)s - %(message)s'
-)
+###--------------------------------->>>>>>>
+# log, output and cache locations of a run; a shard (index, count) gets its own log, journal and caches,
+# and writes its partial outputs to data/output/shards/shard-{index}-of-{count}/
+# a shard's signatures are compared across all shards by --merge, see shards.mergeDuplicates
+def runPaths(shard=None):
+    paths = {
+        'log_file': LOG_FILE,
+        'journal': JOURNAL_FILE,
+        'robots_cache': ROBOTS_CACHE_FILE,
+        'fetch_cache': fetchcache.FETCH_CACHE_FILE,
+        'signatures': SIGNATURE_FILE
+    }
+
+    if shard is None:
+        return {**paths, 'output_dir': LOG_OUTPUT}
+
+    return {
+        **{name: shardFile(path, *shard) for name, path in paths.items()},
+        'output_dir': shardOutput(*shard)
+    }
+
 
 ###--------------------------------->>>>>>>
-#
-def executeWebsiteWords():
+# the command line run: one Crawler job over data/input/url-list.csv, see pipeline.py
+# resume=True replays the crawl journal of an interrupted run and only fetches the URLs it had not finished
+# shard=(index, count) crawls only the domains hashed to that shard, see shards.py
+# depth > 0 follows same-domain links up to depth levels from each listed URL, at most max_pages pages
+# per domain, and adds per-institution outputs, see frontier.py
+# returns the job's word and site metrics and its output files for the diagnostic summary, None when the run failed
+def executeWebsiteWords(resume=False, shard=None, depth=CRAWL_DEPTH, max_pages=DOMAIN_PAGE_BUDGET):
+    paths = runPaths(shard)
 
     try:
         # installs project dependencies, ensures data directory and its contents exists
-        setupProjectStructure(LOG_FILE)
-
-        # reads URLs from data/input/url-list.csv 
-        urls_to_scrape = readDataInput()
-        all_word_data = {}
-        all_site_data = {}
-
-        # reads site's robots.txt file and returns a disallowed paths list
-        for website, details in urls_to_scrape.items():
-            log.info(f"Details for website {website}: {details}")
-            institution = details['Institution']
-            category = details['Category']
-            state = details['State']
-            city = details['City']
-            disallowed_paths = robots.checkPermissions(website, ROBOT_RETRY)
-
-            # uses 'continue' to loop-skip scrapeWebsite() according to site's robots.txt file permissions
-            if any(disallowed_path in website for disallowed_path in disallowed_paths):
-                log.info(f'Skipping {website} due to disallowed path.')
-                #print(f'-Skipping {website} due to disallowed path.')
-                continue
-
-            # takes in a URL, sends a request, parses and assembles the response into appropriate data dictionary
-            #scraped_data = scrapeWebsite(website, HEADERS)
-            try:
-                scraped_data = scrapeWebsite(website, HEADERS)
-            except Exception as e:
-                log.error(f"Error scraping {website}: {e}")
-                #print(f"Error scraping {website}: {e}")
-                continue
-            
-            # splits scraped_data dictionary of dictionaries into two seperate dictionaries for writing output files
-            if scraped_data:
-                all_word_data[website] = scraped_data['words']
-                all_site_data[website] = {
-                    'Category': category,
-                    'State': state,
-                    'City': city,
-                    'Institution': institution,
-                    **scraped_data['site']
-                }
-
-            # rate limiting
-            time.sleep(.1) 
-
-        # writes word-data.csv and site-data.csv data output files
-        writeWordData(all_word_data)
-        writeSiteData(all_site_data)
-        sortDataOutput(
-            'data/output/*-word-data.csv', 
-            'data/output/*-site-data.csv'
+        setupProjectStructure(paths['log_file'])
+
+        # streams normalized, de-duplicated URLs from data/input/url-list.csv,
+        # the first sites are crawled while the rest of the file is still being read
+        urls_to_scrape = readUrlInput(INPUT_FILE)
+        if shard:
+            urls_to_scrape = selectShard(urls_to_scrape, *shard)
+
+        crawler = Crawler(
+            urls_to_scrape,
+            output_dir=paths['output_dir'],
+            depth=depth,
+            max_pages=max_pages,
+            journal_file=paths['journal'],
+            resume=resume,
+            robots_cache=paths['robots_cache'],
+            fetch_cache=paths['fetch_cache'] if FETCH_CACHE else None,
+            log_file=paths['log_file'],
+            signature_file=paths['signatures']
         )
+        return crawler.run()
+
+    # completed URLs are already in the journal, keeps the caches and leaves the outputs unwritten
+    except KeyboardInterrupt:
+        log.warning('Interrupted, completed URLs are saved in the crawl journal, rerun with --resume')
+        print('Interrupted, completed URLs are saved in the crawl journal, rerun with --resume')
+        raise
 
-        # converts logs/scraper.log to log-data.csv data output file
-        executeLogParser(LOG_FILE, LOG_OUTPUT)
-    
     except Exception as e:
         log.error(f'An error occurred during execution: {e}')
         #print(f'An error occurred during execution: {e}')
 
+    # the process runs a single job, its caches are closed with it
+    finally:
+        closeCaches()
+
 
 ###--------------------------------->>>>>>>
 #
 if __name__ == "__main__":
-    runtime = Diagnostics()
+    parser = argparse.ArgumentParser(description='Website Words web scraper')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run from data/cache/crawl-journal.jsonl')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='0-based shard of this process, with --shard-count')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help='split the input by domain into this many shards')
+    parser.add_argument('--merge', action='store_true',
+                        help='combine the outputs of the --shard-count shards in data/output/shards/ into one run in data/output/')
+    parser.add_argument('--depth', type=int, default=CRAWL_DEPTH,
+                        help='follow same-domain links this many levels from each listed URL')
+    parser.add_argument('--max-pages', type=int, default=DOMAIN_PAGE_BUDGET,
+                        help='pages crawled per domain when following links')
+    args = parser.parse_args()
+
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be in 0 .. --shard-count - 1')
+
+    if args.depth < 0 or args.max_pages < 1:
+        parser.error('--depth must be 0 or more and --max-pages at least 1')
+
+    if args.merge and args.shard_count < 2:
+        parser.error('--merge needs the --shard-count of the crawl to combine')
+
+    if args.merge:
+        configureLogging(LOG_FILE, LOG_FORMAT)
+        outputs = mergeShards(args.shard_count)
+        if WORD_INDEX and outputs:
+            indexRun(outputs['word-data'])
+        raise SystemExit
+
+    shard = (args.shard_index, args.shard_count) if args.shard_count > 1 else None
+    paths = runPaths(shard)
+    configureLogging(paths['log_file'], LOG_FORMAT)
+    metrics.installLogCounter()
+
+    runtime = Diagnostics(paths['output_dir'])
     runtime.start()
-    executeWebsiteWords()
+    run_metrics = executeWebsiteWords(resume=args.resume, shard=shard, depth=args.depth, max_pages=args.max_pages)
+    if run_metrics:
+        runtime.recordWordMetrics(run_metrics['words'])
+        runtime.recordSiteMetrics(run_metrics['sites'])
+        runtime.recordOutputFiles(run_metrics['outputs'])
+    runtime.recordRobotsCache(robots.cacheStats())
+    runtime.recordFetchCache(fetchcache.cacheStats())
+    runtime.recordEventMetrics(metrics.snapshot())
     runtime.end()
     runtime.summary()
+
+    # raw counters and histograms of the shard, added up by --merge
+    if shard and run_metrics:
+        writeEventMetrics(paths['output_dir'], run_metrics['timestamp'])
+
+    # shards are indexed once merged, as one run
+    if WORD_INDEX and run_metrics and not shard:
+        indexRun(run_metrics['outputs'].get('word-data'))
     
\ No newline at end of file
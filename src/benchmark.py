@@ -0,0 +1,416 @@
+"""
+Benchmarks for Website Words: micro-benchmarks of the hot paths and an offline run of the whole pipeline.
+
+COMMAND:        python src/benchmark.py [name ...] [--save-baseline] [--urls N --hosts N --latency MS ...]
+                runs every benchmark when no name is given, from the repository root
+                results are compared with data/bench/baseline.json, --save-baseline stores them there
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from benchserver import PAGES, ServerOptions, serve
+from extractor import extractPage
+from robots import parseRobots, selectRules, RobotRules
+from tokenizer import countWords
+
+FIXTURES = 'data/bench/fixtures/*.html'
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WebsiteWords.py')
+BASELINE_FILE = 'data/bench/baseline.json'
+HIGHER_IS_BETTER = ('URLs/s', 'MB/s')
+REGRESSION = 0.10   # flagged when a result is this much worse than the baseline
+REPEAT = 5          # timings are the best of this many runs, one busy moment does not count as a regression
+
+_results = {}
+_section = ''
+
+###--------------------------------->>>>>>>
+# starts a group of results, printed as a heading and used as the prefix of their baseline keys
+def section(title):
+    global _section
+    _section = title
+    print(title)
+
+
+###--------------------------------->>>>>>>
+# prints and records one result line: name, microseconds per call
+def report(name, seconds, calls):
+    reportValue(name, seconds / calls * 1e6, 'us/call')
+
+
+###--------------------------------->>>>>>>
+# seconds of the fastest of REPEAT runs of `number` calls
+def bestTime(call, number):
+    return min(timeit.repeat(call, number=number, repeat=REPEAT))
+
+
+###--------------------------------->>>>>>>
+#
+def reportValue(name, value, unit):
+    _results[f'{_section} | {name}'] = [value, unit]
+    print(f'  {name:<40} {value:>10.2f} {unit}')
+
+
+###--------------------------------->>>>>>>
+# compiled RobotRules.isAllowed vs the old substring scan over a flat Disallow list
+def benchmarkRobotRules(rule_counts=(20, 200, 2000), url_count=2000):
+
+    for rule_count in rule_counts:
+        benchmarkRobotLookup(rule_count, url_count)
+
+
+###--------------------------------->>>>>>>
+#
+def benchmarkRobotLookup(rule_count, url_count):
+    rng = random.Random(27)
+    sections = [f'/section{n}/page{m}' for n in range(rule_count) for m in range(3)]
+    lines = ['User-agent: *']
+    lines += [f'Disallow: /section{n}/' for n in range(0, rule_count, 2)]
+    lines += [f'Allow: /section{n}/page1' for n in range(0, rule_count, 4)]
+    lines += ['Disallow: /*.pdf$', 'Disallow: /search?q=*']
+    text = '\n'.join(lines)
+    urls = [f'https://www.example.edu{rng.choice(sections)}' for _ in range(url_count)]
+
+    matcher = RobotRules(selectRules(parseRobots(text), '*'))
+    disallowed_paths = [line.split(':')[1].strip() for line in lines if line.startswith('Disallow:')]
+
+    section(f'robots: {rule_count} sections, {len(lines) - 1} rules, {url_count} URLs')
+    report('compile RobotRules', bestTime(
+        lambda: RobotRules(selectRules(parseRobots(text), '*')), 20), 20)
+    report('RobotRules.isAllowed', bestTime(
+        lambda: [matcher.isAllowed(url) for url in urls], 5), 5 * url_count)
+    report('substring scan (previous)', bestTime(
+        lambda: [any(path in url for path in disallowed_paths) for url in urls], 5), 5 * url_count)
+
+
+###--------------------------------->>>>>>>
+# the word-count loop scrapeWebsite used before tokenizer.py, kept as the benchmark reference
+def previousWordCount(text_content):
+    word_count = {}
+    for word in text_content.split():
+        word = word.lower().strip('.,!?')
+        word_count[word] = word_count.get(word, 0) + 1
+    return word_count
+
+
+###--------------------------------->>>>>>>
+# tokenizer.countWords vs the previous per-token loop on the recorded HTML fixtures (see their SOURCES.txt)
+def benchmarkTokenizer(number=20):
+    from bs4 import BeautifulSoup
+
+    for fixture in sorted(glob.glob(FIXTURES)):
+        with open(fixture, 'r', encoding='utf-8') as file:
+            text_content = BeautifulSoup(file.read(), 'lxml').get_text(separator=' ')
+
+        if countWords(text_content, 'legacy') != previousWordCount(text_content):
+            print(f'  !! legacy policy differs from the previous loop on {fixture}')
+
+        section(f'tokenizer: {os.path.basename(fixture)}, {len(text_content.split())} tokens')
+        report('previous loop', bestTime(
+            lambda: previousWordCount(text_content), number), number)
+        report("countWords 'legacy'", bestTime(
+            lambda: countWords(text_content, 'legacy'), number), number)
+        report("countWords 'unicode'", bestTime(
+            lambda: countWords(text_content, 'unicode'), number), number)
+
+
+###--------------------------------->>>>>>>
+# the BeautifulSoup extraction scrapeWebsite used before extractor.py, kept as the benchmark reference
+def previousExtraction(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+    word_count = countWords(soup.get_text(separator=' '))
+    title = soup.find('meta', attrs={'name': 'title'}).get('content', '').strip() \
+        if soup.find('meta', attrs={'name': 'title'}) else 'N/A'
+    description = soup.find('meta', attrs={'name': 'description'})['content'] \
+        if soup.find('meta', attrs={'name': 'description'}) else 'N/A'
+
+    return {
+        'words': word_count,
+        'site': {
+            'images': len(soup.find_all('img')),
+            'links': len(soup.find_all('a')),
+            'forms': len(soup.find_all('form')),
+            'stylesheets': len(soup.find_all('link', rel='stylesheet')),
+            'scripts': len(soup.find_all('script', src=True)),
+            'cert': 'N/A',
+            'host': 'N/A',
+            'title': title,
+            'description': description,
+            'status': 'ok',
+        }
+    }
+
+
+###--------------------------------->>>>>>>
+# peak traced allocation of one call, in bytes
+def peakMemory(call):
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+###--------------------------------->>>>>>>
+# extractor.extractPage vs BeautifulSoup tree + repeated find_all: parse time and peak memory
+def benchmarkExtractor(number=10):
+
+    for fixture in sorted(glob.glob(FIXTURES)):
+        with open(fixture, 'r', encoding='utf-8') as file:
+            html = file.read()
+
+        if extractPage(html) != previousExtraction(html):
+            print(f'  !! extractPage differs from the BeautifulSoup extraction on {fixture}')
+
+        section(f'extractor: {os.path.basename(fixture)}, {len(html) / 1024:.0f} KiB')
+        report('BeautifulSoup + find_all (previous)', bestTime(
+            lambda: previousExtraction(html), number), number)
+        report('extractPage', bestTime(
+            lambda: extractPage(html), number), number)
+        reportValue('peak memory previous', peakMemory(lambda: previousExtraction(html)) / 1024, 'KiB')
+        reportValue('peak memory extractPage', peakMemory(lambda: extractPage(html)) / 1024, 'KiB')
+
+
+###--------------------------------->>>>>>>
+# one `python -X importtime WebsiteWords.py --help` start: wall seconds and cumulative
+# import microseconds of each top-level import (interpreter startup and the entry point's own)
+def importProfile(directory):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', ENTRY_POINT, '--help'],
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    wall = time.perf_counter() - started
+    modules = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            modules[name.strip()] = int(cumulative)
+
+    return wall, modules
+
+
+###--------------------------------->>>>>>>
+# startup cost: interpreter start to argument parsing, and the requirements check
+# (importlib.metadata vs the `pip install -r` run it replaced)
+def benchmarkStartup(runs=5):
+    from utility import checkRequirements
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'logs'))
+        profiles = [importProfile(directory) for _ in range(runs)]
+
+    wall = statistics.median(profile[0] for profile in profiles)
+    modules = profiles[-1][1]
+
+    section(f'startup: WebsiteWords.py --help, median of {runs} runs')
+    reportValue('interpreter start to exit', wall * 1000, 'ms')
+    for name, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:8]:
+        reportValue('import ' + name, cumulative / 1000, 'ms')
+
+    report('checkRequirements', timeit.timeit(checkRequirements, number=runs), runs)
+    report('pip install -r requirements.txt (previous)', timeit.timeit(lambda: subprocess.run(
+        [sys.executable, '-m', 'pip', 'install', '-r', 'requirements.txt'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ), number=1), 1)
+
+
+###--------------------------------->>>>>>>
+# the whole pipeline against benchserver.py: `urls` pages spread over `hosts` simulated hosts,
+# run by executeWebsiteWords() in a fresh interpreter in a scratch directory (see runPipeline)
+# urls defaults to one URL per recorded page, beyond that pages are served again under new URLs
+# reports throughput, stage latency percentiles and the peak RSS of the largest process
+def benchmarkPipeline(urls=None, hosts=10, depth=0, read_timeout=2.0, **server_options):
+    urls = urls or len(glob.glob(PAGES))
+    options = ServerOptions(**server_options)
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    server = context.Process(target=serve, args=([0] * hosts, options, os.getcwd(), ready), daemon=True)
+    server.start()
+
+    try:
+        ports = ready.get(timeout=30)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for path in ('logs', 'data/input', 'data/output'):
+                os.makedirs(os.path.join(directory, path))
+            shutil.copy('requirements.txt', directory)
+
+            with open(os.path.join(directory, 'data/input/url-list.csv'), 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['Category', 'State', 'City', 'Institution', 'Website'])
+                for n in range(urls):
+                    writer.writerow(['Bench', 'XX', 'Bench', f'Host {n % hosts}',
+                                     f'http://127.0.0.1:{ports[n % hosts]}/page/{n}'])
+
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'pipeline-run',
+                 json.dumps({'depth': depth, 'read_timeout': read_timeout})],
+                cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+
+            with open(os.path.join(directory, 'bench-result.json'), 'r') as file:
+                result = json.load(file)
+
+    finally:
+        server.terminate()
+        server.join()
+
+    counters = result['metrics']['counters']
+    histograms = result['metrics']['histograms']
+    wall = result['wall']
+
+    section(f'pipeline: {urls} URLs on {hosts} hosts, {options.describe()}')
+    reportValue('wall time', wall, 's')
+    reportValue('URL throughput', counters.get('urls_attempted', 0) / wall, 'URLs/s')
+    reportValue('download throughput', counters.get('bytes_downloaded', 0) / 1e6 / wall, 'MB/s')
+    for stage in ('ttfb', 'download', 'parse'):
+        if histograms.get(stage):
+            reportValue(f'{stage} p50', histograms[stage]['P50'], 'ms')
+            reportValue(f'{stage} p99', histograms[stage]['P99'], 'ms')
+    reportValue('peak RSS', result['peak_rss_kib'] / 1024, 'MiB')
+    print(f'  {"fetched / errors / timeouts":<40} {counters.get("urls_fetched", 0):>10} / '
+          f'{counters.get("fetch_errors", 0)} / {counters.get("url_timeouts", 0)}')
+
+
+###--------------------------------->>>>>>>
+# child side of benchmarkPipeline: runs the pipeline like `python src/WebsiteWords.py` in the current
+# directory and writes wall time, event metrics and peak RSS (KiB, largest of this process and its
+# parser processes) to bench-result.json; stdout belongs to the pipeline's own progress output
+def runPipeline(options):
+    import resource
+    import metrics
+    import session
+    import WebsiteWords
+    from logparser import configureLogging
+
+    session.READ_TIMEOUT = options['read_timeout']
+    configureLogging(WebsiteWords.LOG_FILE, WebsiteWords.LOG_FORMAT)
+    metrics.installLogCounter()
+
+    started = time.perf_counter()
+    WebsiteWords.executeWebsiteWords(depth=options['depth'])
+    wall = time.perf_counter() - started
+
+    with open('bench-result.json', 'w') as file:
+        json.dump({
+            'wall': wall,
+            'metrics': metrics.snapshot(),
+            'peak_rss_kib': max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            )
+        }, file)
+
+
+###--------------------------------->>>>>>>
+# prints each result next to its baseline value, results worse by more than REGRESSION are marked !!
+def compareBaseline(baseline_file=BASELINE_FILE):
+
+    if not os.path.exists(baseline_file):
+        print(f'no baseline in `{baseline_file}`, store one with --save-baseline')
+        return
+
+    with open(baseline_file, 'r') as file:
+        baseline = json.load(file)
+
+    print(f'compared with `{baseline_file}`')
+    current = None
+
+    for key, (value, unit) in _results.items():
+        if key not in baseline or not baseline[key][0]:
+            continue
+
+        title, name = key.split(' | ', 1)
+        if title != current:
+            current = title
+            print(title)
+
+        change = value / baseline[key][0] - 1
+        worse = -change if unit in HIGHER_IS_BETTER else change
+        marker = '!!' if worse > REGRESSION else '  '
+        print(f'{marker}{name:<40} {baseline[key][0]:>10.2f} -> {value:>10.2f} {unit:<8} {change:+.1%}')
+
+
+###--------------------------------->>>>>>>
+# adds this run's results to the baseline file, results of benchmarks not run are kept
+def saveBaseline(baseline_file=BASELINE_FILE):
+    baseline = {}
+
+    if os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as file:
+            baseline = json.load(file)
+
+    baseline.update(_results)
+    with open(baseline_file, 'w') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+
+    print(f'baseline saved to `{baseline_file}`')
+
+
+BENCHMARKS = {
+    'robots': benchmarkRobotRules,
+    'tokenizer': benchmarkTokenizer,
+    'extractor': benchmarkExtractor,
+    'startup': benchmarkStartup,
+    'pipeline': benchmarkPipeline,
+}
+
+###--------------------------------->>>>>>>
+#
+if __name__ == "__main__":
+
+    if sys.argv[1:2] == ['pipeline-run']:
+        runPipeline(json.loads(sys.argv[2]))
+        raise SystemExit
+
+    parser = argparse.ArgumentParser(description='Website Words benchmarks')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run: {", ".join(BENCHMARKS)}, all when none is given')
+    parser.add_argument('--save-baseline', action='store_true', help=f'store the results in {BASELINE_FILE}')
+    parser.add_argument('--urls', type=int, default=None, help='pipeline: URLs crawled, one per recorded page by default')
+    parser.add_argument('--hosts', type=int, default=10, help='pipeline: simulated hosts')
+    parser.add_argument('--depth', type=int, default=0, help='pipeline: link-following depth')
+    parser.add_argument('--latency', type=float, default=20, help='pipeline: ms per response')
+    parser.add_argument('--jitter', type=float, default=10, help='pipeline: up to this many ms more')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='pipeline: share of pages answered 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.01, help='pipeline: share of pages stalled')
+    parser.add_argument('--stall', type=float, default=3.0, help='pipeline: seconds a stalled page waits')
+    parser.add_argument('--page-kb', type=int, default=0, help='pipeline: grow pages to this size')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(unknown)}')
+
+    for name in args.names or BENCHMARKS:
+        if name == 'pipeline':
+            benchmarkPipeline(
+                args.urls, args.hosts, args.depth,
+                latency=args.latency,
+                jitter=args.jitter,
+                error_rate=args.error_rate,
+                timeout_rate=args.timeout_rate,
+                stall=args.stall,
+                page_kb=args.page_kb
+            )
+        else:
+            BENCHMARKS[name]()
+
+    compareBaseline()
+    if args.save_baseline:
+        saveBaseline()
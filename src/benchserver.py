@@ -0,0 +1,165 @@
+"""
+Local stand-in for the web, used by the pipeline benchmark in benchmark.py.
+
+COMMAND:        python src/benchserver.py [--port 8765] [--hosts 20] [--latency 20] [--error-rate .02] ...
+SERVES:         /page/{n}     the recorded pages in data/bench/pages/ (see SOURCES.txt there),
+                              page n gets the n % count-th page in file name order
+                /page/{name}  the recorded page of that file name, so the pages' own relative links resolve
+                /robots.txt   data/bench/pages/robots.txt, recorded from the same site
+                on 127.0.0.1, one port per simulated host: the crawler throttles and caches per host:port
+"""
+import argparse
+import glob
+import http.server
+import os
+import random
+import socketserver
+import threading
+import time
+
+PAGES = 'data/bench/pages/*.html'
+ROBOTS_PAGE = 'data/bench/pages/robots.txt'
+
+###--------------------------------->>>>>>>
+# what the stand-in server does to each request: latency in ms (plus up to jitter ms), the share of
+# requests answered 500 or stalled for `stall` seconds before any byte is sent, and page_kb to grow
+# pages by repeating the recorded page; faults are decided per path from `seed`, so runs are reproducible
+class ServerOptions:
+
+    def __init__(self, latency=20, jitter=10, error_rate=0.0, timeout_rate=0.0, stall=5.0, page_kb=0, seed=27):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.stall = stall
+        self.page_kb = page_kb
+        self.seed = seed
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def describe(self):
+        return (f'{self.latency}+{self.jitter} ms latency, {self.error_rate:.0%} errors, '
+                f'{self.timeout_rate:.0%} stalls of {self.stall:g} s, '
+                f'{f"{self.page_kb} KiB" if self.page_kb else "recorded-size"} pages')
+
+
+###--------------------------------->>>>>>>
+# request handler of the stand-in server, keep-alive like a real host
+class BenchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = ServerOptions()
+    pages = []
+    pages_by_name = {}
+    robots = b''
+
+    def do_GET(self):
+        rng = random.Random(f'{self.options.seed}:{self.path}')
+        time.sleep((self.options.latency + rng.random() * self.options.jitter) / 1000)
+
+        if self.path == '/robots.txt':
+            return self.reply(200, self.robots, 'text/plain')
+
+        if not self.path.startswith('/page/') or not self.pages:
+            return self.reply(404, b'', 'text/html')
+
+        roll = rng.random()
+        if roll < self.options.error_rate:
+            return self.reply(500, b'', 'text/html')
+
+        if roll < self.options.error_rate + self.options.timeout_rate:
+            time.sleep(self.options.stall)
+
+        name = self.path[len('/page/'):].split('?')[0]
+        if name.isdigit():
+            page = self.pages[int(name) % len(self.pages)]
+        elif name in self.pages_by_name:
+            page = self.pages_by_name[name]
+        else:
+            return self.reply(404, b'', 'text/html')
+
+        self.reply(200, page, 'text/html; charset=utf-8')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def reply(self, status, body, content_type):
+
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # the client gave up on a stalled request
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+###--------------------------------->>>>>>>
+# {file name: page} of the recorded pages in file name order, each repeated up to page_kb KiB when a page size is set
+def loadPages(page_kb=0):
+    pages = {}
+
+    for filename in sorted(glob.glob(PAGES)):
+        with open(filename, 'rb') as file:
+            page = file.read()
+
+        if page_kb:
+            page = page * max(1, -(-page_kb * 1024 // len(page)))
+
+        pages[os.path.basename(filename)] = page
+
+    return pages
+
+
+###--------------------------------->>>>>>>
+# serves the simulated hosts until the process is stopped, run in its own process by benchmark.py
+# port 0 picks a free port, the bound ports are put on the `ready` queue once every host listens
+def serve(ports, options, root='.', ready=None):
+    os.chdir(root)
+    BenchHandler.options = options
+    BenchHandler.pages_by_name = loadPages(options.page_kb)
+    BenchHandler.pages = list(BenchHandler.pages_by_name.values())
+
+    with open(ROBOTS_PAGE, 'rb') as file:
+        BenchHandler.robots = file.read()
+
+    servers = [BenchServer(('127.0.0.1', port), BenchHandler) for port in ports]
+    if ready is not None:
+        ready.put([server.server_address[1] for server in servers])
+
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers[0].serve_forever()
+
+
+###--------------------------------->>>>>>>
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Website Words benchmark server')
+    parser.add_argument('--port', type=int, default=8765, help='first port, one per host')
+    parser.add_argument('--hosts', type=int, default=1, help='simulated hosts')
+    parser.add_argument('--latency', type=float, default=20, help='ms added to every response')
+    parser.add_argument('--jitter', type=float, default=10, help='up to this many ms more, per path')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of pages answered 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of pages stalled')
+    parser.add_argument('--stall', type=float, default=5.0, help='seconds a stalled page waits')
+    parser.add_argument('--page-kb', type=int, default=0, help='grow pages to at least this size')
+    args = parser.parse_args()
+
+    serve(range(args.port, args.port + args.hosts), ServerOptions(
+        args.latency, args.jitter, args.error_rate, args.timeout_rate, args.stall, args.page_kb
+    ))
@@ -0,0 +1,91 @@
+import logging as log
+
+WORD_ROW_GROUP = 250_000
+COMPRESSION = 'zstd'
+
+###--------------------------------->>>>>>>
+# pyarrow is only needed when a columnar output format is selected
+def importArrow():
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        return pa, pq
+
+    except ImportError as e:
+        raise RuntimeError('Parquet output requires pyarrow, install it with: pip install pyarrow') from e
+
+
+###--------------------------------->>>>>>>
+# word-data schema: the repeated Website (or Institution) column is dictionary encoded
+def wordSchema(key_column='Website'):
+    pa, _ = importArrow()
+
+    return pa.schema([
+        (key_column, pa.dictionary(pa.int32(), pa.string())),
+        ('Word', pa.string()),
+        ('Count', pa.int64())
+    ])
+
+
+###--------------------------------->>>>>>>
+# writes word-data rows to a compressed Parquet file in row groups of WORD_ROW_GROUP rows
+class WordParquetWriter:
+
+    def __init__(self, filename, key_column='Website'):
+        pa, pq = importArrow()
+        self.pa = pa
+        self.filename = filename
+        self.schema = wordSchema(key_column)
+        self.writer = pq.ParquetWriter(filename, self.schema, compression=COMPRESSION, use_dictionary=True)
+        self.websites = []
+        self.words = []
+        self.counts = []
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def writeRows(self, rows):
+
+        for website, word, count in rows:
+            self.websites.append(website)
+            self.words.append(word)
+            self.counts.append(int(count))
+
+        if len(self.words) >= WORD_ROW_GROUP:
+            self.flush()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def flush(self):
+
+        if not self.words:
+            return
+
+        table = self.pa.table([
+            self.pa.array(self.websites, self.pa.string()).dictionary_encode(),
+            self.pa.array(self.words, self.pa.string()),
+            self.pa.array(self.counts, self.pa.int64())
+        ], schema=self.schema)
+        self.writer.write_table(table)
+        self.websites, self.words, self.counts = [], [], []
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+        self.flush()
+        self.writer.close()
+        log.info(f'U- Word-data saved to `{self.filename}`')
+        print(f'U- Word-data saved to `{self.filename}`')
+
+
+###--------------------------------->>>>>>>
+# yields word-data columns in record batches, without loading the whole file
+def iterParquetBatches(filename, columns):
+    _, pq = importArrow()
+    parquet_file = pq.ParquetFile(filename)
+
+    for batch in parquet_file.iter_batches(columns=columns):
+        yield batch
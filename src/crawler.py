@@ -0,0 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging as log
+import multiprocessing
+import threading
+import time
+import metrics
+
+###--------------------------------->>>>>>>
+# per-host politeness: hands out request slots spaced `delay` seconds apart for each domain,
+# so different hosts are fetched in parallel while a single host is still rate limited
+class HostThrottle:
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+
+    ###--------------------------------->>>>>>>
+    # blocks the calling thread until the host's next request slot opens
+    def wait(self, host):
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.delay
+
+        pause = slot - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+
+###--------------------------------->>>>>>>
+# runs task(website, details) for every input URL on a pool of max_workers threads
+# yields (website, details, result) as each task finishes, in completion order
+def crawlWebsites(urls_to_scrape, task, max_workers):
+    items = iter(urls_to_scrape)
+    max_pending = max_workers * 2
+    pending = {}
+
+    log.info(f'C- Crawling with {max_workers} worker threads')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        while True:
+
+            # keeps a bounded number of tasks queued so large inputs are not submitted all at once
+            while len(pending) < max_pending:
+                item = next(items, None)
+                if item is None:
+                    break
+                website, details = item
+                pending[pool.submit(task, website, details)] = item
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                website, details = pending.pop(future)
+                yield website, details, future.result()
+
+
+###--------------------------------->>>>>>>
+# parse stage: hands each fetched page to a pool of max_workers parser processes
+# at most max_workers * 2 pages wait in the queue, beyond that the fetch stage is held back
+# yields (website, details, page) in completion order with the parse result in page['result'],
+# pages that already carry a result (served from the fetch cache) and failed fetches (None) pass straight through
+# timings recorded inside the parser processes are merged into this process's metrics
+def parseWebsites(fetched, task, max_workers):
+    max_queue = max_workers * 2
+    pending = {}
+
+    log.info(f'C- Parsing with {max_workers} worker processes')
+
+    # spawned, not forked: the fetch stage's threads are already running
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+
+        for website, details, page in fetched:
+
+            if page is None or 'result' in page:
+                yield website, details, page
+                continue
+
+            pending[pool.submit(metrics.runMeasured, task, website, page)] = (website, details, page)
+
+            # yields finished parses right away, blocks only while the queue is full
+            done = [future for future in pending if future.done()]
+            if len(pending) - len(done) >= max_queue:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                yield completeParse(future, *pending.pop(future))
+
+        for future in list(pending):
+            yield completeParse(future, *pending.pop(future))
+
+
+###--------------------------------->>>>>>>
+# attaches the parse result to the page and drops the raw body
+def completeParse(future, website, details, page):
+
+    try:
+        page['result'], parse_metrics = future.result()
+        metrics.mergeMetrics(parse_metrics)
+        log.info(f'Word count completed for {website}', extra={'url': website})
+
+    except Exception as e:
+        log.error(f'Error parsing {website}: {e}', extra={'url': website})
+        page['result'] = None
+
+    del page['content']
+    return website, details, page
@@ -1,13 +1,18 @@
 from datetime import datetime
-import csv
 import glob
+import heapq
 import json
 import os
 import time
 
+TOP_WORDS = 25
+CHUNK_ROWS = 500_000
+COMBINE_EVERY = 8
+
 class Diagnostics:
 
-    def __init__(self):
+    def __init__(self, output_dir='data/output'):
+        self.output_dir = output_dir
         
         # run time
         self.date = None
@@ -18,6 +23,7 @@ class Diagnostics:
         self.log_file = None
         self.site_file = None
         self.word_file = None 
+        self.data_files_recorded = False
         # data output file size
         self.log_file_size = None
         self.site_file_size = None
@@ -26,11 +32,18 @@ class Diagnostics:
         self.total_words = 0
         self.unique_words = 0
         self.sum_counts = 0
+        self.top_words = []
+        self.site_word_distribution = None
+        self.site_count_distribution = None
+        self.word_metrics_recorded = False
         # site data metrics
+        self.site_count = 0
         self.sum_image_count = 0
         self.sum_link_count = 0
         self.sum_stylesheet_count = 0
         self.sum_script_count = 0
+        self.near_duplicate_count = 0
+        self.site_metrics_recorded = False
         # log data metrics
         self.urls_attempted = 0
         self.url_timeouts = 0
@@ -41,6 +54,15 @@ class Diagnostics:
         self.robot_log_count = 0
         self.utility_log_count = 0
         self.scraper_log_count = 0
+        # event metrics
+        self.event_counters = {}
+        self.stage_latency = {}
+        # cache metrics
+        self.robots_cache_hits = 0
+        self.robots_cache_misses = 0
+        self.robots_cache_domains = 0
+        self.fetch_cache_served = 0
+        self.fetch_cache_misses = 0
 
 
     ###--------------------------------->>>>>>>
@@ -54,8 +76,14 @@ class Diagnostics:
     Start Console ---------------------------------------------------------------------]
     |  -Require file:   Diagnostics.py   produces diagnostic summary JSON file
     |  -Require file:   Scraper.py       produces site and word data CSV files
+    |  -Require file:   Extractor.py     parses HTML in one pass, counts words with Tokenizer.py
     |  -Require file:   Utility.py       sets up project structure, reads, writes, sorts
+    |  -Require file:   Columnar.py      writes Parquet data files when selected
     |  -Require file:   Robots.py        obtains site permissions for crawling
+    |  -Require file:   Pipeline.py      runs a crawl job from its URL source to its outputs
+    |  -Require file:   Crawler.py       runs concurrent fetches with per-host rate limiting
+    |  -Require file:   Session.py       shares pooled keep-alive HTTP connections
+    |  -Require file:   Metrics.py       counts events and times each crawl stage
     |  -Require file:   Logparser.py     produces log data CSV file
             
     Running Website Words!
@@ -80,6 +108,71 @@ class Diagnostics:
         ''')
 
 
+    ###--------------------------------->>>>>>>
+    # run time of a combined run, e.g. the earliest start and latest end of merged shards
+    def recordRunTime(self, start_time, end_time):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.duration = end_time - start_time
+        self.date = datetime.fromtimestamp(start_time).strftime("%m-%d-%Y")
+
+
+    ###--------------------------------->>>>>>>
+    # takes robots cache counts from robots.cacheStats() at the end of the run
+    def recordRobotsCache(self, stats):
+        self.robots_cache_hits = stats['hits']
+        self.robots_cache_misses = stats['misses']
+        self.robots_cache_domains = stats['domains']
+
+
+    ###--------------------------------->>>>>>>
+    # takes fetch cache counts from fetchcache.cacheStats() at the end of the run
+    def recordFetchCache(self, stats):
+        self.fetch_cache_served = stats['served']
+        self.fetch_cache_misses = stats['misses']
+
+
+    ###--------------------------------->>>>>>>
+    # takes word metrics from WordDataWriter.stats() as the pipeline wrote them, word-data is not re-read
+    def recordWordMetrics(self, stats):
+        vocabulary = stats['vocabulary']
+        self.total_words = stats['rows']
+        self.unique_words = len(vocabulary)
+        self.sum_counts = sum(vocabulary.values())
+        self.top_words = heapq.nsmallest(TOP_WORDS, vocabulary.items(), key=lambda item: (-item[1], item[0]))
+        self.site_word_distribution = describeDistribution(stats['site_words'])
+        self.site_count_distribution = describeDistribution(stats['site_counts'])
+        self.word_metrics_recorded = True
+
+
+    ###--------------------------------->>>>>>>
+    # takes site metrics from the run's collected site details, site-data is not re-read
+    def recordSiteMetrics(self, site_data):
+        self.site_count = len(site_data)
+        self.sum_image_count = sum(site['images'] for site in site_data.values())
+        self.sum_link_count = sum(site['links'] for site in site_data.values())
+        self.sum_stylesheet_count = sum(site['stylesheets'] for site in site_data.values())
+        self.sum_script_count = sum(site['scripts'] for site in site_data.values())
+        self.near_duplicate_count = sum(1 for site in site_data.values() if site.get('duplicate_of'))
+        self.site_metrics_recorded = True
+
+
+    ###--------------------------------->>>>>>>
+    # near-duplicate pages counted while merging shards' site-data, see shards.mergeSiteData()
+    def recordNearDuplicates(self, count):
+        self.near_duplicate_count = count
+
+
+    ###--------------------------------->>>>>>>
+    # takes the run's output files from the {kind: [paths]} the pipeline returns, instead of picking
+    # the newest files in output_dir; the Parquet copy is preferred when a run wrote both
+    def recordOutputFiles(self, outputs):
+        self.word_file = preferredDataFile(outputs.get('word-data'))
+        self.site_file = preferredDataFile(outputs.get('site-data'))
+        self.log_file = preferredDataFile(outputs.get('log-data'))
+        self.data_files_recorded = True
+
+
     ###--------------------------------->>>>>>>
     # 
     def summary(self):
@@ -87,7 +180,6 @@ class Diagnostics:
         self.recordFileSizes()
         self.calculateWordMetrics()
         self.calculateSiteMetrics() 
-        self.calculateLogMetrics()
         self.processDiagnosticSummary()
         self.correctBadTimestamp()
 
@@ -95,19 +187,33 @@ class Diagnostics:
     ###--------------------------------->>>>>>>
     # 
     def assignDataFiles(self):
-        word_files = glob.glob('data/output/*-word-data.csv')
-        if word_files:
-            self.word_file = max(word_files, key=os.path.getctime)
 
-        site_files = glob.glob('data/output/*-site-data.csv')
-        if site_files:
-            self.site_file = max(site_files, key=os.path.getctime)
+        if self.data_files_recorded:
+            return
+
+        self.word_file = self.latestDataFile('word-data')
+        self.site_file = self.latestDataFile('site-data')
 
-        log_files = glob.glob('data/output/*-log-data.csv')
+        log_files = glob.glob(os.path.join(self.output_dir, '*-log-data.csv'))
         if log_files:
             self.log_file = max(log_files, key=os.path.getctime)
 
 
+    ###--------------------------------->>>>>>>
+    # newest CSV or Parquet output of a kind, the Parquet copy is preferred when a run wrote both
+    def latestDataFile(self, kind):
+        data_files = glob.glob(os.path.join(self.output_dir, f'*-{kind}.csv')) + \
+            glob.glob(os.path.join(self.output_dir, f'*-{kind}.parquet'))
+
+        if not data_files:
+            return None
+
+        latest_file = max(data_files, key=os.path.getctime)
+        parquet_file = os.path.splitext(latest_file)[0] + '.parquet'
+
+        return parquet_file if os.path.exists(parquet_file) else latest_file
+
+
     ###--------------------------------->>>>>>>
     # 
     def recordFileSizes(self):
@@ -123,76 +229,101 @@ class Diagnostics:
 
 
     ###--------------------------------->>>>>>>
-    # 
+    # fallback when the run did not record word metrics: aggregates word-data in chunks of CHUNK_ROWS rows,
+    # per-chunk word and site totals are combined every COMBINE_EVERY chunks to keep memory bounded
     def calculateWordMetrics(self):
 
-        if self.word_file and os.path.exists(self.word_file):
-            
-            with open(self.word_file, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                header = next(reader)
-                word_index = header.index('Word')
-                count_index = header.index('Count')
-                unique_words_set = set()
+        if self.word_metrics_recorded or not self.word_file or not os.path.exists(self.word_file):
+            return
+
+        import pandas as pd
+        word_totals = []
+        site_totals = []
+
+        for chunk in self.readWordChunks():
+            self.total_words += len(chunk)
+            word_totals.append(chunk.groupby('Word', sort=False)['Count'].sum())
+            site_totals.append(chunk.groupby('Website', sort=False, observed=True)['Count'].agg(['size', 'sum']))
 
-                for row in reader:
-                    word = row[word_index]
-                    unique_words_set.add(word)
-                    count = int(row[count_index])
-                    self.sum_counts += count
-                    self.total_words += 1
+            if len(word_totals) >= COMBINE_EVERY:
+                word_totals = [pd.concat(word_totals).groupby(level=0).sum()]
+                site_totals = [pd.concat(site_totals).groupby(level=0).sum()]
 
-                self.unique_words = len(unique_words_set)
+        if not word_totals:
+            return
+
+        word_totals = pd.concat(word_totals).groupby(level=0).sum()
+        site_totals = pd.concat(site_totals).groupby(level=0).sum()
+
+        self.unique_words = len(word_totals)
+        self.sum_counts = int(word_totals.sum())
+        top_words = word_totals.rename_axis('Word').reset_index(name='Count')
+        top_words = top_words.sort_values(['Count', 'Word'], ascending=[False, True]).head(TOP_WORDS)
+        self.top_words = [(word, int(count)) for word, count in zip(top_words['Word'], top_words['Count'])]
+        self.site_word_distribution = describeDistribution(site_totals['size'].to_numpy())
+        self.site_count_distribution = describeDistribution(site_totals['sum'].to_numpy())
 
 
     ###--------------------------------->>>>>>>
-    # 
-    def calculateSiteMetrics(self):
+    # yields word-data as DataFrames of at most CHUNK_ROWS rows, words are read as text ('nan', '1' stay words)
+    def readWordChunks(self):
+        import pandas as pd
 
-        if self.site_file and os.path.exists(self.site_file):
+        if self.word_file.endswith('.parquet'):
+            from columnar import iterParquetBatches
 
-            with open(self.site_file, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
+            for batch in iterParquetBatches(self.word_file, ['Website', 'Word', 'Count']):
+                yield batch.to_pandas()
 
-                for row in reader:
-                    self.sum_image_count += int(row.get('ImageCount', 0))
-                    self.sum_link_count += int(row.get('LinkCount', 0))
-                    self.sum_stylesheet_count += int(row.get('StylesheetCount', 0))
-                    self.sum_script_count += int(row.get('ScriptCount', 0))
+        else:
+            yield from pd.read_csv(
+                self.word_file,
+                usecols=['Website', 'Word', 'Count'],
+                dtype={'Website': str, 'Word': str, 'Count': 'int64'},
+                keep_default_na=False,
+                chunksize=CHUNK_ROWS
+            )
 
 
     ###--------------------------------->>>>>>>
-    # 
-    def calculateLogMetrics(self):
+    # fallback when the run did not record site metrics
+    def calculateSiteMetrics(self):
 
-        if self.log_file and os.path.exists(self.log_file):
+        if self.site_metrics_recorded or not self.site_file or not os.path.exists(self.site_file):
+            return
 
-            with open(self.log_file, 'r', encoding='utf-8') as file:
+        import pandas as pd
+        columns = ['ImageCount', 'LinkCount', 'StylesheetCount', 'ScriptCount']
 
-                for line in file:
+        if self.site_file.endswith('.parquet'):
+            chunks = [pd.read_parquet(self.site_file, columns=columns)]
+        else:
+            chunks = pd.read_csv(self.site_file, usecols=columns, chunksize=CHUNK_ROWS)
 
-                    if "R-" in line:
-                        self.robot_log_count += 1
-                    elif "U-" in line:
-                        self.utility_log_count += 1
-                    else:
-                        self.scraper_log_count += 1
-                    
-                    if "INFO" in line:
-                        self.level_info_count += 1
-                    elif "WARNING" in line:
-                        self.level_warning_count += 1
-                    elif "ERROR" in line:
-                        self.level_error_count += 1
+        for site_data in chunks:
+            self.site_count += len(site_data)
+            self.sum_image_count += int(site_data['ImageCount'].sum())
+            self.sum_link_count += int(site_data['LinkCount'].sum())
+            self.sum_stylesheet_count += int(site_data['StylesheetCount'].sum())
+            self.sum_script_count += int(site_data['ScriptCount'].sum())
 
-                    if "Successfully fetched" in line or "Error fetching" in line:
-                        self.urls_attempted += 1
-                    
-                    if "Max retries exceeded" in line or "SSLError" in line:
-                        self.url_timeouts += 1
 
-                    if "due to disallowed path" in line:
-                        self.disallowed_skip_count += 1
+    ###--------------------------------->>>>>>>
+    # takes the run's event counters and stage latency histograms from metrics.snapshot(),
+    # the log metrics are counted as records are logged instead of being read back from log-data
+    def recordEventMetrics(self, snapshot):
+        counters = snapshot['counters']
+        self.event_counters = counters
+        self.stage_latency = snapshot['histograms']
+        self.urls_attempted = counters.get('urls_attempted', 0)
+        self.url_timeouts = counters.get('url_timeouts', 0)
+        self.disallowed_skip_count = counters.get('disallowed_skips', 0)
+        self.level_info_count = counters.get('log_info', 0)
+        self.level_warning_count = counters.get('log_warning', 0)
+        self.level_error_count = counters.get('log_error', 0)
+        self.robot_log_count = counters.get('log_robot', 0)
+        self.utility_log_count = counters.get('log_utility', 0)
+        self.scraper_log_count = counters.get('log_scraper', 0)
 
 
     ###--------------------------------->>>>>>>
@@ -216,13 +347,18 @@ class Diagnostics:
             "word_metrics": {
                 "TotalWords": self.total_words,
                 "UniqueWords": self.unique_words,
-                "SumCounts": self.sum_counts
+                "SumCounts": self.sum_counts,
+                "TopWords": dict(self.top_words),
+                "WordsPerSite": self.site_word_distribution,
+                "CountsPerSite": self.site_count_distribution
             },
             "site_metrics": {
+                "SiteCount": self.site_count,
                 "SumImageCount": self.sum_image_count,
                 "SumLinkCount": self.sum_link_count,
                 "SumStylesheetCount": self.sum_stylesheet_count,
-                "SumScriptCount": self.sum_script_count
+                "SumScriptCount": self.sum_script_count,
+                "NearDuplicateCount": self.near_duplicate_count
             },
             "log_metrics": {
                 "UrlsAttempted": self.urls_attempted,
@@ -234,11 +370,22 @@ class Diagnostics:
                 "RobotLogCount": self.robot_log_count,
                 "UtilityLogCount": self.utility_log_count,
                 "ScraperLogCount": self.scraper_log_count
+            },
+            "cache_metrics": {
+                "RobotsCacheHits": self.robots_cache_hits,
+                "RobotsCacheMisses": self.robots_cache_misses,
+                "RobotsCacheDomains": self.robots_cache_domains,
+                "UrlsServedFromCache": self.fetch_cache_served,
+                "UrlsParsed": self.fetch_cache_misses
+            },
+            "event_metrics": {
+                "Counters": self.event_counters,
+                "StageLatencyMs": self.stage_latency
             }
         }
 
         timestamp = '-'.join(os.path.basename(self.word_file).split('-')[0:2])
-        output_file = os.path.join('data/output', f'{timestamp}-diagnostic-summary.json')
+        output_file = os.path.join(self.output_dir, f'{timestamp}-diagnostic-summary.json')
 
         with open(output_file, 'w', encoding='utf-8') as summary_file:
             json.dump(summary_data, summary_file, indent=4)
@@ -259,4 +406,32 @@ class Diagnostics:
                     update = file.replace(current_timestamp, goode_timestamp)
                     os.rename(file, update)
                     print(f'Corrected bad timestamp for {file}')
-        
\ No newline at end of file
+        
+
+
+###--------------------------------->>>>>>>
+# Parquet file of a kind when one was written, else the first file, None when there is none
+def preferredDataFile(filenames):
+
+    if not filenames:
+        return None
+
+    return next((filename for filename in filenames if filename.endswith('.parquet')), filenames[0])
+
+
+###--------------------------------->>>>>>>
+# min / median / mean / p90 / max of a per-site value, None when there are no sites
+def describeDistribution(values):
+    import numpy as np
+    values = np.asarray(values, dtype=np.int64)
+
+    if not values.size:
+        return None
+
+    return {
+        "Min": int(values.min()),
+        "Median": float(np.median(values)),
+        "Mean": float(values.mean()),
+        "P90": float(np.percentile(values, 90)),
+        "Max": int(values.max())
+    }
@@ -0,0 +1,208 @@
+from urllib.parse import urljoin
+from lxml import etree
+import metrics
+from tokenizer import NORMALIZATION, countWords
+
+# text inside these elements is not page text (BeautifulSoup's get_text skips it too)
+SKIP_TEXT_TAGS = {'script', 'style', 'template'}
+
+###--------------------------------->>>>>>>
+# lxml parser target: receives start/end/data events while the HTML is parsed, no tree is built
+# collects the page text, tag counts and meta fields in one streaming pass
+# with collect_links the hrefs of <a> tags (except rel="nofollow") and a <base href> are kept as well
+class PageTarget:
+
+    def __init__(self, collect_links=False):
+        self.text_nodes = []
+        self.pending = []
+        self.skip_depth = 0
+        self.image_count = 0
+        self.link_count = 0
+        self.form_count = 0
+        self.css_count = 0
+        self.js_count = 0
+        self.title = None
+        self.description = None
+        self.links = [] if collect_links else None
+        self.base = None
+
+
+    ###--------------------------------->>>>>>>
+    # a text node ends at the next tag, comment or processing instruction
+    def flushText(self):
+
+        if self.pending:
+            if not self.skip_depth:
+                self.text_nodes.append(''.join(self.pending))
+            self.pending = []
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def start(self, tag, attrib):
+        self.flushText()
+
+        if tag in SKIP_TEXT_TAGS:
+            self.skip_depth += 1
+            if tag == 'script' and 'src' in attrib:
+                self.js_count += 1
+
+        elif tag == 'img':
+            self.image_count += 1
+
+        elif tag == 'a':
+            self.link_count += 1
+            if self.links is not None and 'href' in attrib and 'nofollow' not in attrib.get('rel', '').split():
+                self.links.append(attrib['href'].strip())
+
+        elif tag == 'base':
+            if self.base is None and 'href' in attrib:
+                self.base = attrib['href'].strip()
+
+        elif tag == 'form':
+            self.form_count += 1
+
+        elif tag == 'link':
+            if 'stylesheet' in attrib.get('rel', '').split():
+                self.css_count += 1
+
+        elif tag == 'meta':
+            name = attrib.get('name')
+            if name == 'title' and self.title is None:
+                self.title = attrib.get('content', '').strip()
+            elif name == 'description' and self.description is None:
+                self.description = attrib.get('content', '')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def end(self, tag):
+        self.flushText()
+
+        if tag in SKIP_TEXT_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def data(self, data):
+        self.pending.append(data)
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def comment(self, text):
+        self.flushText()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def pi(self, target, data=None):
+        self.flushText()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+        self.flushText()
+        return self
+
+
+###--------------------------------->>>>>>>
+# parses an HTML document into the {'words', 'site'} result of scraper.scrapeWebsite
+def extractPage(html, normalization=NORMALIZATION):
+    return extractChunks([html], normalization)
+
+
+###--------------------------------->>>>>>>
+# same result from a document fed in decoded text chunks, the whole page is never held as one string
+# chunks are cut just before a '<': libxml2's push parser loses the rest of the page when a
+# closing </script> or </style> tag is split between two feeds
+# the HTML pass and the word count are timed into the 'parse' and 'count' histograms
+# with a base_url (the fetched page's final URL) the result also lists the page's links, made absolute
+def extractChunks(chunks, normalization=NORMALIZATION, base_url=None):
+
+    with metrics.timer('parse'):
+        parser = etree.HTMLParser(target=PageTarget(collect_links=base_url is not None))
+        tail = ''
+
+        for chunk in chunks:
+            chunk = tail + chunk
+            cut = chunk.rfind('<')
+
+            if cut > 0:
+                parser.feed(chunk[:cut])
+                tail = chunk[cut:]
+            else:
+                tail = chunk
+
+        if tail:
+            parser.feed(tail)
+        page = parser.close()
+
+    # extract and process the text content (for -> word-data.csv)
+    with metrics.timer('count'):
+        word_count = countWords(' '.join(page.text_nodes), normalization)
+
+    # extract site details (for -> site-data.csv)
+    '''placeholder for certificate information'''
+    site_details = {
+        'images': page.image_count,
+        'links': page.link_count,
+        'forms': page.form_count,
+        'stylesheets': page.css_count,
+        'scripts': page.js_count,
+        'cert': 'N/A',
+        'host': 'N/A',
+        'title': page.title if page.title is not None else 'N/A',
+        'description': page.description if page.description is not None else 'N/A',
+        'status': 'ok',
+    }
+
+    result = {
+        'words': word_count,
+        'site': site_details
+    }
+
+    if base_url is not None:
+        result['links'] = absoluteLinks(page.links, urljoin(base_url, page.base or ''))
+
+    return result
+
+
+###--------------------------------->>>>>>>
+# resolves hrefs against the page, keeps the first of each http(s) link
+def absoluteLinks(hrefs, base_url):
+    links = {}
+
+    for href in hrefs:
+        try:
+            link = urljoin(base_url, href)
+        except ValueError:
+            continue
+
+        if link.startswith(('http://', 'https://')):
+            links.setdefault(link, None)
+
+    return list(links)
+
+
+###--------------------------------->>>>>>>
+# result for a page that was fetched but not parsed (too large, not HTML): no words,
+# the reason is kept in site-data's FetchStatus column
+def skippedPage(status):
+    return {
+        'words': {},
+        'site': {
+            'images': 0,
+            'links': 0,
+            'forms': 0,
+            'stylesheets': 0,
+            'scripts': 0,
+            'cert': 'N/A',
+            'host': 'N/A',
+            'title': 'N/A',
+            'description': 'N/A',
+            'status': status,
+        }
+    }
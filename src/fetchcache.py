@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging as log
+import os
+import sqlite3
+import threading
+import time
+
+FETCH_CACHE_FILE = 'data/cache/fetch-cache.sqlite'
+COMMIT_EVERY = 100
+
+_fetch_cache = None
+_fetch_cache_lock = threading.Lock()
+_fetch_stats = {'served': 0, 'misses': 0}
+
+###--------------------------------->>>>>>>
+# persistent per-URL cache of validators (ETag, Last-Modified), body hash and the scraped {'words', 'site'} result
+# lets the next run send conditional requests and skip parsing pages that did not change
+class FetchCache:
+
+    def __init__(self, filename=FETCH_CACHE_FILE):
+        self.filename = filename
+        self.served = 0
+        self.misses = 0
+        self.stores = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                normalization TEXT,
+                result TEXT,
+                fetched REAL
+            )
+        ''')
+        self.connection.commit()
+
+
+    ###--------------------------------->>>>>>>
+    # returns the cached entry for a URL, only when it was scraped under the same word normalization
+    def lookup(self, url, normalization):
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT etag, last_modified, content_hash, result FROM pages WHERE url = ? AND normalization = ?',
+                (url, normalization)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {
+            'etag': row[0],
+            'last_modified': row[1],
+            'content_hash': row[2],
+            'result': row[3]
+        }
+
+
+    ###--------------------------------->>>>>>>
+    # conditional request headers for a cached entry
+    @staticmethod
+    def conditionalHeaders(entry):
+        headers = {}
+
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+
+    ###--------------------------------->>>>>>>
+    # decodes a cached entry's result and counts the URL as served from the cache
+    def serve(self, entry):
+
+        with self.lock:
+            self.served += 1
+
+        return json.loads(entry['result'])
+
+
+    ###--------------------------------->>>>>>>
+    # saves a freshly parsed page, called from the main thread as results come in
+    def store(self, url, page, normalization):
+
+        with self.lock:
+            self.misses += 1
+            self.stores += 1
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    url,
+                    page.get('etag'),
+                    page.get('last_modified'),
+                    page.get('content_hash'),
+                    normalization,
+                    json.dumps(page['result']),
+                    time.time()
+                )
+            )
+
+            if self.stores % COMMIT_EVERY == 0:
+                self.connection.commit()
+
+
+    ###--------------------------------->>>>>>>
+    # commits pending stores, the cache stays open for the jobs still using it
+    def flush(self):
+
+        with self.lock:
+            self.connection.commit()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+        log.info(f'F- Fetch cache saved to `{self.filename}`: {self.served} served, {self.misses} parsed')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def stats(self):
+
+        with self.lock:
+            return {
+                'served': self.served,
+                'misses': self.misses
+            }
+
+
+###--------------------------------->>>>>>>
+# body fingerprint used to detect unchanged pages when the server sends no validators
+def contentHash(content):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+###--------------------------------->>>>>>>
+# returns the run's fetch cache, opened on first use
+def getFetchCache(filename=FETCH_CACHE_FILE):
+    global _fetch_cache
+
+    with _fetch_cache_lock:
+        if _fetch_cache is None:
+            _fetch_cache = FetchCache(filename)
+
+    return _fetch_cache
+
+
+###--------------------------------->>>>>>>
+# commits and closes the fetch cache at the end of a run
+def closeFetchCache():
+    global _fetch_cache, _fetch_stats
+
+    with _fetch_cache_lock:
+        if _fetch_cache is not None:
+            _fetch_stats = _fetch_cache.stats()
+            _fetch_cache.close()
+            _fetch_cache = None
+
+
+###--------------------------------->>>>>>>
+# fetch cache counts for the diagnostic summary, kept after the cache is closed
+def cacheStats():
+    return _fetch_stats if _fetch_cache is None else _fetch_cache.stats()
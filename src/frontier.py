@@ -0,0 +1,105 @@
+import heapq
+import metrics
+from inputreader import VisitedSet, normalizeUrl, urlKey
+
+CRAWL_DEPTH = 0             # links followed from each seed URL, 0 crawls only the listed pages
+DOMAIN_PAGE_BUDGET = 50     # pages crawled per domain, seeds included
+
+###--------------------------------->>>>>>>
+# URLs of a link-following crawl, iterated by crawler.crawlWebsites() like the plain input stream
+# discovered same-domain links come out first, ordered by (depth, the page's rank within its domain),
+# which alternates between domains; the next seed is only taken once no discovered link is waiting,
+# so sites are finished before new ones are opened and the queue stays small
+# every URL is admitted once (VisitedSet), within its domain's page budget and its robots.txt rules
+# (allowed); a page reached from an earlier seed is credited to that seed's institution
+class Frontier:
+
+    def __init__(self, seeds, max_depth=CRAWL_DEPTH, max_pages=DOMAIN_PAGE_BUDGET, allowed=None):
+        self.seeds = iter(seeds)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.allowed = allowed
+        self.queue = []
+        self.visited = VisitedSet()
+        self.pages = {}
+        self.sequence = 0
+
+
+    ###--------------------------------->>>>>>>
+    # raises StopIteration while nothing is waiting, the crawl starts another pass when links arrive later
+    def __next__(self):
+
+        if self.queue:
+            _, _, _, url, details = heapq.heappop(self.queue)
+            return url, details
+
+        for website, details in self.seeds:
+            if self.visit(website):
+                return website, {**details, 'Depth': 0}
+
+        raise StopIteration
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def __iter__(self):
+        return self
+
+
+    ###--------------------------------->>>>>>>
+    # marks a page as crawled and counts it against its domain's budget, False when it already was
+    # a seed is always crawled, even when its domain has used up the budget
+    def visit(self, url):
+
+        if not self.visited.add(urlKey(url)):
+            return False
+
+        domain = url.split('/')[2]
+        self.pages[domain] = self.pages.get(domain, 0) + 1
+        return True
+
+
+    ###--------------------------------->>>>>>>
+    # queues the same-domain links of a crawled page one level deeper, details are inherited from the page
+    # the domain is the host a seed was served from (url, after redirects: example.edu -> www.example.edu),
+    # kept in the details as 'Domain' so every page of the seed's crawl stays on it
+    def discover(self, website, details, links, url=None):
+        depth = details.get('Depth', 0) + 1
+
+        if not links or depth > self.max_depth:
+            return
+
+        domain = details.get('Domain') or (url or website).split('/')[2]
+        link_details = {**details, 'Depth': depth, 'Domain': domain}
+
+        for link in links:
+            link = normalizeUrl(link)
+
+            if link is None or link.split('/')[2] != domain:
+                continue
+
+            key = urlKey(link)
+            if key in self.visited:
+                continue
+
+            rank = self.pages.get(domain, 0)
+            if rank >= self.max_pages:
+                metrics.increment('links_over_budget')
+                break
+
+            if self.allowed and not self.allowed(link):
+                metrics.increment('links_disallowed')
+                continue
+
+            self.visited.add(key)
+            self.pages[domain] = rank + 1
+            heapq.heappush(self.queue, (depth, rank, self.sequence, link, link_details))
+            self.sequence += 1
+            metrics.increment('links_queued')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def waiting(self):
+        return len(self.queue)
+
@@ -0,0 +1,194 @@
+from array import array
+from collections import deque
+import csv
+import hashlib
+import logging as log
+from urllib.parse import urlsplit, urlunsplit
+
+INPUT_FILE = 'data/input/url-list.csv'
+INPUT_WINDOW = 1000
+ACTIVE_DOMAINS = 50     # domains handed out in turn, below session.POOL_HOSTS so their keep-alive pools stay open
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+###--------------------------------->>>>>>>
+# canonical form of an input URL: lower-case scheme and host, no default port, no fragment,
+# '/' for an empty path and no trailing '/' on any other path (/about/ and /about are one page);
+# a URL without a scheme gets https://, returns None when it is not http(s)
+def normalizeUrl(url):
+    url = url.strip()
+
+    if not url:
+        return None
+
+    if '://' not in url:
+        url = f'https://{url}'
+
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = parts.hostname
+        port = parts.port
+    except ValueError:
+        return None
+
+    if scheme not in DEFAULT_PORTS or not host:
+        return None
+
+    if ':' in host:
+        host = f'[{host}]'
+
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f'{host}:{port}'
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+###--------------------------------->>>>>>>
+# 64-bit digest of a normalized URL, the seen-sets (VisitedSet) hold these instead of the URL strings
+def urlKey(url):
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+###--------------------------------->>>>>>>
+# set of 64-bit URL keys (urlKey) in one open-addressing array('Q'), 8 bytes a slot
+# and at most half full: millions of URLs fit in tens of MB where a set of ints takes several times more
+class VisitedSet:
+
+    def __init__(self, capacity=1024):
+        self.slots = array('Q', bytes(8 * capacity))
+        self.count = 0
+
+
+    ###--------------------------------->>>>>>>
+    # adds a key, False when it was already in the set
+    def add(self, key):
+
+        if (self.count + 1) * 2 > len(self.slots):
+            self.grow()
+
+        slot = self.find(key)
+        if self.slots[slot]:
+            return False
+
+        self.slots[slot] = key or 1
+        self.count += 1
+        return True
+
+
+    ###--------------------------------->>>>>>>
+    # slot holding the key, or the empty slot where it belongs; 0 marks an empty slot, so key 0 is stored as 1
+    def find(self, key):
+        key = key or 1
+        mask = len(self.slots) - 1
+        slot = key & mask
+
+        while self.slots[slot] and self.slots[slot] != key:
+            slot = (slot + 1) & mask
+
+        return slot
+
+
+    ###--------------------------------->>>>>>>
+    # rehashes straight from the old array, a list of the keys would cost as much as the set this replaces
+    def grow(self):
+        old = self.slots
+        self.slots = array('Q', bytes(16 * len(old)))
+
+        for key in old:
+            if key:
+                self.slots[self.find(key)] = key
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def __contains__(self, key):
+        return bool(self.slots[self.find(key)])
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def __len__(self):
+        return self.count
+
+
+###--------------------------------->>>>>>>
+# streams (website, details) from the CSV input as rows are read, so the crawl starts right away
+# URLs are normalized, the first row of a duplicate URL wins, invalid URLs are skipped
+def readUrlInput(filename=INPUT_FILE):
+    seen = VisitedSet()
+    loaded = duplicates = invalid = 0
+
+    try:
+        with open(filename, mode='r', newline='') as file:
+            reader = csv.DictReader(file)
+
+            for row in reader:
+                website = normalizeUrl(row['Website'] or '')
+
+                if website is None:
+                    invalid += 1
+                    log.warning(f'U- Skipping invalid URL in `{filename}`: {row["Website"]!r}')
+                    continue
+
+                key = urlKey(website)
+                if key in seen:
+                    duplicates += 1
+                    continue
+
+                seen.add(key)
+                loaded += 1
+                yield website, {
+                    'Category': row['Category'],
+                    'State': row['State'],
+                    'City': row['City'],
+                    'Institution': row['Institution']
+                }
+
+        log.info(f'U- {loaded} URLs loaded from `{filename}` ({duplicates} duplicates, {invalid} invalid skipped)')
+        print(f'U- URLs loaded from `{filename}`')
+
+    except Exception as e:
+        log.error(f'U- Error loading URLs from `{filename}`: {e}')
+        print((f'U- Error loading URLs from `{filename}`: {e}'))
+
+
+###--------------------------------->>>>>>>
+# reorders a URL stream so consecutive URLs go to different domains: up to `window` URLs are
+# buffered per domain, and up to `active` domains at a time are handed out round-robin until
+# their buffered URLs run out, the next waiting domain (in input order) then takes the free place;
+# each domain keeps its input order
+# the crawler threads spread over hosts instead of queueing behind one host's rate limit, while a
+# domain's URLs stay grouped within a small rotation, so its keep-alive connections and robots
+# rules are still warm when its next URL comes up
+def interleaveDomains(items, window=INPUT_WINDOW, active=ACTIVE_DOMAINS):
+    items = iter(items)
+    rotation = {}
+    waiting = {}
+    buffered = 0
+    exhausted = False
+
+    while True:
+
+        while not exhausted and buffered < window:
+            item = next(items, None)
+            if item is None:
+                exhausted = True
+                break
+            domain = item[0].split('/')[2]
+            (rotation if domain in rotation else waiting).setdefault(domain, deque()).append(item)
+            buffered += 1
+
+        while waiting and len(rotation) < active:
+            domain = next(iter(waiting))
+            rotation[domain] = waiting.pop(domain)
+
+        if not rotation:
+            return
+
+        # takes the domain at the front of the rotation and moves it to the back
+        domain = next(iter(rotation))
+        queue = rotation.pop(domain)
+        yield queue.popleft()
+        buffered -= 1
+
+        if queue:
+            rotation[domain] = queue
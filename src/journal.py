@@ -0,0 +1,81 @@
+import json
+import logging as log
+import os
+
+JOURNAL_FILE = 'data/cache/crawl-journal.jsonl'
+
+###--------------------------------->>>>>>>
+# append-only JSONL checkpoint of completed URLs and their {'words', 'site'} results
+# a fresh run truncates the journal, a resumed run replays it and keeps appending
+class CrawlJournal:
+
+    def __init__(self, filename=JOURNAL_FILE, resume=False):
+        self.filename = filename
+        self.resume = resume
+        self.completed = set()
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        if not resume or not os.path.exists(filename):
+            open(filename, 'w').close()
+
+        # terminates a torn last line so the next record starts on its own line
+        elif os.path.getsize(filename):
+            with open(filename, 'rb+') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+
+        self.file = None
+
+
+    ###--------------------------------->>>>>>>
+    # streams the journal of an interrupted run: yields (website, details, result) and marks each URL done
+    # a torn last line from a crash is ignored
+    def replay(self):
+
+        with open(self.filename, 'r', encoding='utf-8') as file:
+
+            for line in file:
+
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning(f'J- Ignoring incomplete journal line in `{self.filename}`')
+                    continue
+
+                self.completed.add(entry['website'])
+                yield entry['website'], entry['details'], entry['result']
+
+        log.info(f'J- Resumed {len(self.completed)} completed URLs from `{self.filename}`')
+        print(f'J- Resumed {len(self.completed)} completed URLs from `{self.filename}`')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def isCompleted(self, website):
+        return website in self.completed
+
+
+    ###--------------------------------->>>>>>>
+    # appends one finished URL, flushed right away so a crash or Ctrl-C keeps it
+    def record(self, website, details, result):
+
+        if self.file is None:
+            self.file = open(self.filename, 'a', encoding='utf-8')
+
+        self.file.write(json.dumps({
+            'website': website,
+            'details': details,
+            'result': result
+        }) + '\n')
+        self.file.flush()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,60 +1,144 @@
 import csv
-from datetime import datetime
+import json
+import logging as log
 import os
+import re
+from utility import claimTimestamp
+
+LOG_FORMAT = 'json'     # 'json' lines or the original 'text' format
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+TEXT_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - ([A-Z]+) - (.*)$')
+LOG_FIELDS = [
+    'Timestamp',
+    'LogLevel',
+    'Message',
+    'Module',
+    'Url',
+    'ElapsedMs'
+]
+
+###--------------------------------->>>>>>>
+# writes one JSON object per log record: timestamp, level, module, message, plus the url and
+# elapsed_ms fields passed with extra={...}; newlines in a message stay inside its record
+class JsonLogFormatter(log.Formatter):
+
+    def format(self, record):
+        entry = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'module': record.module,
+            'message': record.getMessage()
+        }
+
+        if record.exc_info:
+            entry['message'] += '\n' + self.formatException(record.exc_info)
+
+        for field in ('url', 'elapsed_ms'):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+###--------------------------------->>>>>>>
+# sends the root logger to LOG_FILE in the selected format
+def configureLogging(LOG_FILE, log_format=LOG_FORMAT):
+    handler = log.FileHandler(LOG_FILE, encoding='utf-8')
+
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(log.Formatter(TEXT_FORMAT))
+
+    log.basicConfig(handlers=[handler], level=log.INFO)
+
 
 ###--------------------------------->>>>>>>
 # script for converting runtime log data in logs/scraper.log to a timestamped data output file
 # produces: data/output/{timestamp}-log-data.csv
-def executeLogParser(LOG_FILE, LOG_OUTPUT):
+# streams record by record, memory does not grow with the size of the log, returns the file written
+# timestamp names the file after a crawl job's outputs, the current minute when None
+def executeLogParser(LOG_FILE, LOG_OUTPUT, timestamp=None):
     log_lines = readScraperLog(LOG_FILE)
     log_data = parseScraperLog(log_lines)
-    logToCsv(log_data, LOG_OUTPUT)
-    
-    
+    return logToCsv(log_data, LOG_OUTPUT, timestamp)
+
+
 ###--------------------------------->>>>>>>
-# reads the contents of the scraper.log file and returns the lines
+# yields the lines of the scraper.log file
 def readScraperLog(LOG_FILE):
 
-    with open(LOG_FILE, 'r') as file:
-        return file.readlines()
-    
+    with open(LOG_FILE, 'r', encoding='utf-8', errors='replace') as file:
+        yield from file
+
 
 ###--------------------------------->>>>>>>
-# parses log lines into structured data with timestamps, log levels, and messages
+# parses log lines into structured records with timestamps, log levels, messages and typed fields
+# reads JSON lines and the text format; in text logs, lines that do not start a record
+# (pip output, tracebacks) are continuation lines of the record before them
 def parseScraperLog(log_lines):
-    log_data = []
+    entry = None
 
     for line in log_lines:
-        parts = line.split(' - ')
+        line = line.rstrip('\n')
+
+        if line.startswith('{'):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+
+            if record is not None:
+                if entry:
+                    yield closeEntry(entry)
+                entry = None
+                yield {
+                    'Timestamp': record.get('timestamp'),
+                    'LogLevel': record.get('level'),
+                    'Message': record.get('message'),
+                    'Module': record.get('module'),
+                    'Url': record.get('url'),
+                    'ElapsedMs': record.get('elapsed_ms')
+                }
+                continue
 
-        if len(parts) >= 3:
-            timestamp = parts[0]
-            log_level = parts[1]
-            message = ' - '.join(parts[2:]).strip()
-            log_data.append({
-                'Timestamp': timestamp,
-                'LogLevel': log_level,
-                'Message': message
-            })
+        match = TEXT_LINE.match(line)
 
-    return log_data
+        if match:
+            if entry:
+                yield closeEntry(entry)
+            entry = {
+                'Timestamp': match.group(1),
+                'LogLevel': match.group(2),
+                'Message': match.group(3).strip()
+            }
+
+        elif entry:
+            entry['Message'] += '\n' + line
+
+    if entry:
+        yield closeEntry(entry)
+
+
+###--------------------------------->>>>>>>
+# a text record ends where the next one starts, trailing blank continuation lines are dropped
+def closeEntry(entry):
+    entry['Message'] = entry['Message'].rstrip('\n')
+    return entry
 
 
 ###--------------------------------->>>>>>>
-# writes parsed log data into a CSV file with a timestamped filename
-def logToCsv(log_data, LOG_OUTPUT):
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M")
+# writes parsed log data into a CSV file with a timestamped filename, one record at a time, returns its path
+def logToCsv(log_data, LOG_OUTPUT, timestamp=None):
+    timestamp = timestamp or claimTimestamp(LOG_OUTPUT)
     filename = f"{timestamp}-log-data.csv"
     output_file = os.path.join(LOG_OUTPUT, filename)
 
-    with open(output_file, 'w', newline='') as csvfile:
-        fieldnames = [
-            'Timestamp',
-            'LogLevel', 
-            'Message'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=LOG_FIELDS)
         writer.writeheader()
 
         for entry in log_data:
             writer.writerow(entry)
+
+    return output_file
@@ -0,0 +1,234 @@
+from contextlib import contextmanager
+import logging as log
+import math
+import threading
+import time
+
+HISTOGRAM_GROWTH = 1.05     # bucket width, percentiles are exact to within about 2.5%
+PERCENTILES = (50, 90, 99)
+LOG_PREFIXES = {'R-': 'robot', 'U-': 'utility'}
+
+###--------------------------------->>>>>>>
+# latency histogram with log-spaced buckets: constant memory however many URLs are observed,
+# and histograms from parser processes merge by adding bucket counts
+class Histogram:
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def observe(self, value):
+        bucket = math.ceil(math.log(value, HISTOGRAM_GROWTH)) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def merge(self, exported):
+
+        for bucket, count in exported['buckets']:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+        self.count += exported['count']
+        self.total += exported['total']
+        for value in (exported['min'], exported['max']):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+
+    ###--------------------------------->>>>>>>
+    # value at a percentile, the geometric middle of its bucket clamped to the observed range
+    def percentile(self, percent):
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+
+        for bucket in sorted(self.buckets, key=lambda bucket: -math.inf if bucket is None else bucket):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return 0.0
+                value = HISTOGRAM_GROWTH ** (bucket - .5)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def export(self):
+        return {
+            'buckets': list(self.buckets.items()),
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max
+        }
+
+
+    ###--------------------------------->>>>>>>
+    # summary for diagnostic-summary.json, in milliseconds
+    def summary(self):
+
+        if not self.count:
+            return None
+
+        summary = {'Count': self.count, 'Mean': round(self.total / self.count, 3)}
+        for percent in PERCENTILES:
+            summary[f'P{percent}'] = round(self.percentile(percent), 3)
+        summary['Max'] = round(self.max, 3)
+
+        return summary
+
+
+###--------------------------------->>>>>>>
+# named counters (events, bytes) and latency histograms, safe to update from crawler threads
+class Metrics:
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def increment(self, name, amount=1):
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def observe(self, name, milliseconds):
+
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(milliseconds)
+
+
+    ###--------------------------------->>>>>>>
+    # picklable copy, sent back from parser processes
+    def export(self):
+
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.export() for name, histogram in self.histograms.items()}
+            }
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def merge(self, exported):
+
+        with self.lock:
+            for name, amount in exported['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+            for name, histogram in exported['histograms'].items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].merge(histogram)
+
+
+    ###--------------------------------->>>>>>>
+    # {'counters': {...}, 'histograms': {name: {Count, Mean, P50, P90, P99, Max}}}
+    def snapshot(self):
+
+        with self.lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: self.histograms[name].summary() for name in sorted(self.histograms)}
+            }
+
+
+###--------------------------------->>>>>>>
+# counts every log record by level and by source (robot/utility/scraper), so Diagnostics
+# no longer has to read the log back
+class LogCounter(log.Handler):
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def emit(self, record):
+        message = record.getMessage()
+        source = next((name for prefix, name in LOG_PREFIXES.items() if message.startswith(prefix)), 'scraper')
+        self.metrics.increment(f'log_{record.levelname.lower()}')
+        self.metrics.increment(f'log_{source}')
+
+
+_metrics = Metrics()
+
+###--------------------------------->>>>>>>
+# adds to a named counter of the run
+def increment(name, amount=1):
+    _metrics.increment(name, amount)
+
+
+###--------------------------------->>>>>>>
+# records one latency observation in milliseconds
+def observe(name, milliseconds):
+    _metrics.observe(name, milliseconds)
+
+
+###--------------------------------->>>>>>>
+# times the enclosed block into the named histogram
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        _metrics.observe(name, (time.perf_counter() - started) * 1000)
+
+
+###--------------------------------->>>>>>>
+# runs in a parser process: returns the task's result together with the metrics it recorded,
+# the crawler merges them into the main process with mergeMetrics()
+def runMeasured(task, *args):
+    global _metrics
+    _metrics = Metrics()
+    result = task(*args)
+    return result, _metrics.export()
+
+
+###--------------------------------->>>>>>>
+#
+def mergeMetrics(exported):
+    _metrics.merge(exported)
+
+
+###--------------------------------->>>>>>>
+# starts counting log records on the root logger
+def installLogCounter():
+    log.getLogger().addHandler(LogCounter(_metrics))
+
+
+###--------------------------------->>>>>>>
+# the run's counters and histogram summaries for the diagnostic summary
+def snapshot():
+    return _metrics.snapshot()
+
+
+###--------------------------------->>>>>>>
+# the run's raw counters and histogram buckets, mergeable with Metrics.merge()
+def export():
+    return _metrics.export()
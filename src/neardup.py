@@ -0,0 +1,239 @@
+import hashlib
+import logging as log
+import os
+import sqlite3
+import time
+
+SIGNATURE_FILE = 'data/index/signatures.sqlite'
+NUM_PERM = 64           # MinHash values per signature, 4 bytes each
+BANDS = 16              # LSH bands of NUM_PERM / BANDS values, pages sharing a band are compared
+SIMILARITY = 0.8        # estimated count-weighted Jaccard similarity from which two pages count as the same page
+SIZE_RATIO = 1.5        # pages whose word totals differ by more than this factor are never the same page
+MIN_WORDS = 10          # pages with fewer distinct words get no signature, short pages look alike too easily
+SIGNATURE_BYTES = 4 + NUM_PERM * 4      # the page's word total, then the MinHash values
+PRIME = (1 << 31) - 1
+SEED = 27
+SHINGLE_STEP = 0x9E3779B97F4A7C15       # spreads a word's count-bucket shingles over the hash space
+
+_permutations = None
+
+###--------------------------------->>>>>>>
+# MinHash signature of the words on a page and their counts, as a hex string (it travels in the JSON parse result):
+# a word counted c times stands for the shingles (word, 1) .. (word, countBuckets(c)), so two pages using the
+# same vocabulary in different amounts do not look alike; for each of NUM_PERM random hash functions the
+# signature keeps the smallest hash over the page's shingles, and the share of positions where two signatures
+# agree estimates the Jaccard similarity of the two pages' shingles
+# the page's word total comes first, for the SIZE_RATIO check; None for pages with fewer than MIN_WORDS distinct words
+def minhash(words):
+
+    if len(words) < MIN_WORDS:
+        return None
+
+    import numpy as np
+    multipliers, offsets = permutations()
+    hashes = np.fromiter((wordHash(word) for word in words), dtype=np.uint64, count=len(words))
+    buckets = np.fromiter((countBuckets(count) for count in words.values()), dtype=np.int64, count=len(words))
+
+    # shingle k of a word is its hash plus k steps, k counting from 0 for each word
+    starts = np.repeat(np.cumsum(buckets) - buckets, buckets)
+    steps = (np.arange(len(starts)) - starts).astype(np.uint64)
+    shingles = (np.repeat(hashes, buckets) + steps * np.uint64(SHINGLE_STEP)) % PRIME
+    values = (np.outer(shingles, multipliers) + offsets) % PRIME
+
+    total = min(sum(words.values()), 0xFFFFFFFF).to_bytes(4, 'little')
+    return (total + values.min(axis=0).astype('<u4').tobytes()).hex()
+
+
+###--------------------------------->>>>>>>
+# shingles standing for a word counted `count` times: one per doubling (1, 2-3, 4-7, ... -> 1, 2, 3, ...),
+# so a long page adds a handful of shingles per word rather than one per occurrence
+def countBuckets(count):
+    return max(int(count), 1).bit_length()
+
+
+###--------------------------------->>>>>>>
+# the NUM_PERM (a * x + b) mod PRIME hash functions, the same in every process and run (SEED)
+def permutations():
+    global _permutations
+
+    if _permutations is None:
+        import numpy as np
+        generator = np.random.default_rng(SEED)
+        _permutations = (
+            generator.integers(1, PRIME, NUM_PERM, dtype=np.uint64),
+            generator.integers(0, PRIME, NUM_PERM, dtype=np.uint64)
+        )
+
+    return _permutations
+
+
+###--------------------------------->>>>>>>
+# stable 64-bit word hash, independent of Python's hash seed so signatures compare across runs
+def wordHash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+###--------------------------------->>>>>>>
+# whether a hex signature is one minhash() makes today, signatures cached or stored before
+# the word total was added to them have to be computed again
+def isSignature(signature):
+    return signature is not None and len(signature) == SIGNATURE_BYTES * 2
+
+
+###--------------------------------->>>>>>>
+# the word total a signature (bytes) was made from
+def wordTotal(signature):
+    return int.from_bytes(signature[:4], 'little')
+
+
+###--------------------------------->>>>>>>
+# share of the MinHash values two signatures (bytes) have in common
+def similarity(a, b):
+    a, b = memoryview(a)[4:].cast('I'), memoryview(b)[4:].cast('I')
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+###--------------------------------->>>>>>>
+# whether two signatures' (bytes) word totals are within SIZE_RATIO of each other
+def similarSize(a, b, ratio=SIZE_RATIO):
+    small, large = sorted((wordTotal(a), wordTotal(b)))
+    return large <= small * ratio
+
+
+###--------------------------------->>>>>>>
+# LSH index of MinHash signatures: each signature is filed under its BANDS slices, so a lookup only
+# compares the pages sharing a whole slice with it instead of every page seen so far; pages at the
+# SIMILARITY threshold share a band with a probability of 1 - (1 - 0.8 ** 4) ** 16 > 99.9%;
+# the bands cover the MinHash values only, the word total in front of them is checked on a match
+class DuplicateIndex:
+
+    def __init__(self, bands=BANDS, threshold=SIMILARITY):
+        self.bands = bands
+        self.width = NUM_PERM * 4 // bands
+        self.threshold = threshold
+        self.tables = [{} for _ in range(bands)]
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def bandKeys(self, signature):
+        return [signature[4 + band * self.width:4 + (band + 1) * self.width] for band in range(self.bands)]
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def add(self, website, signature):
+
+        for table, key in zip(self.tables, self.bandKeys(signature)):
+            table.setdefault(key, []).append((website, signature))
+
+
+    ###--------------------------------->>>>>>>
+    # most similar indexed website at or above the threshold and of a similar size, None when there is none
+    def match(self, signature):
+        best = None
+        compared = set()
+
+        for table, key in zip(self.tables, self.bandKeys(signature)):
+            for website, candidate in table.get(key, ()):
+
+                if website in compared:
+                    continue
+                compared.add(website)
+
+                if not similarSize(signature, candidate):
+                    continue
+
+                score = similarity(signature, candidate)
+                if score >= self.threshold and (best is None or (-score, website) < best):
+                    best = (-score, website)
+
+        return best[1] if best else None
+
+
+###--------------------------------->>>>>>>
+# {website: canonical website} of the near-duplicate pages among a run's {website: minhash() signature};
+# pages are taken in URL order and each one is compared with the canonical pages before it,
+# so the result does not depend on the order the crawl finished them in; earlier runs' canonical
+# pages (previous, from SignatureStore.load()) count as seen first, a page matching one is marked
+# as a duplicate of a site crawled in an earlier run
+def findDuplicates(signatures, previous=None):
+    index = DuplicateIndex()
+    duplicates = {}
+
+    for website, signature in (previous or {}).items():
+        if website not in signatures and isSignature(signature):
+            index.add(website, bytes.fromhex(signature))
+
+    for website in sorted(signatures):
+
+        if not isSignature(signatures[website]):
+            continue
+
+        signature = bytes.fromhex(signatures[website])
+        canonical = index.match(signature)
+        if canonical is None:
+            index.add(website, signature)
+        else:
+            duplicates[website] = canonical
+
+    return duplicates
+
+
+###--------------------------------->>>>>>>
+# the latest signature of every website crawled by earlier runs and whether it was a duplicate,
+# kept between runs so near-duplicates are found across runs as well as within one
+class SignatureStore:
+
+    def __init__(self, filename=SIGNATURE_FILE):
+        self.filename = filename
+
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS signatures (
+                website TEXT PRIMARY KEY,
+                signature TEXT,
+                duplicate_of TEXT,
+                run TEXT,
+                saved REAL
+            )
+        ''')
+        self.connection.commit()
+
+
+    ###--------------------------------->>>>>>>
+    # {website: signature} of the canonical pages of earlier runs
+    def load(self):
+        rows = self.connection.execute('SELECT website, signature FROM signatures WHERE duplicate_of IS NULL')
+        return dict(rows)
+
+
+    ###--------------------------------->>>>>>>
+    # {website: signature} of one run's pages, its duplicates included
+    def runSignatures(self, run):
+        rows = self.connection.execute('SELECT website, signature FROM signatures WHERE run = ?', (run,))
+        return dict(rows)
+
+
+    ###--------------------------------->>>>>>>
+    # records a run's signatures, a website crawled again keeps only its latest one
+    def save(self, signatures, duplicates, run):
+        saved = time.time()
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)',
+                [
+                    (website, signature, duplicates.get(website), run, saved)
+                    for website, signature in signatures.items() if signature is not None
+                ]
+            )
+
+        log.info(f'N- Saved {len(signatures)} page signatures of run {run} to `{self.filename}`')
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,430 @@
+from functools import partial
+import logging as log
+import os
+import fetchcache
+import metrics
+import resolver
+import robots
+from crawler import HostThrottle, crawlWebsites, parseWebsites
+from frontier import CRAWL_DEPTH, DOMAIN_PAGE_BUDGET, Frontier
+from inputreader import interleaveDomains
+from journal import CrawlJournal
+from logparser import executeLogParser
+from neardup import SignatureStore, findDuplicates, isSignature, minhash
+from robotcache import ROBOTS_CACHE_FILE
+from scraper import fetchWebsite, parseWebsite
+from utility import WordDataWriter, claimTimestamp, writeSiteData, writeInstitutionData, sortDataFile
+
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+ROBOT_RETRY = 3
+CRAWL_WORKERS = 8
+HOST_DELAY = .1
+PARSE_WORKERS = os.cpu_count() or 1     # 0 parses on the crawler threads instead of a process pool
+OUTPUT_FORMATS = ['csv']    # 'csv' and/or 'parquet'
+WORD_NORMALIZATION = 'legacy'   # 'legacy' or 'unicode', see tokenizer.py
+DNS_PREFETCH = True     # resolves upcoming hosts ahead of their fetch, see resolver.py
+NEAR_DUPLICATES = True  # marks pages that repeat another page's words in site-data's DuplicateOf, see neardup.py
+COLLAPSE_DUPLICATES = False     # also leaves the duplicates' rows out of word-data
+
+###--------------------------------->>>>>>>
+# one crawl job: URLs from `source`, fetched with `fetcher`, parsed with `parser`, results handed to `sinks`
+# source:   iterable of (website, details) items, e.g. inputreader.readUrlInput(filename) or a list;
+#           details carry Category, State, City and Institution
+# fetcher:  fetcher(website, headers, conditional_headers) -> page dict or None, like scraper.fetchWebsite
+# parser:   parser(website, page, normalization, follow_links) -> {'words', 'site'[, 'links']},
+#           a module-level function when parse_workers > 0, it runs in spawned processes
+# sinks:    objects with open(timestamp), writeSite(website, details, scraped_data) and close(sites),
+#           close() returns the {kind: [paths]} it wrote; default: a FileSink in output_dir
+# near_duplicates marks each page whose words nearly repeat an earlier page's as its duplicate_of,
+# before the sinks close; signature_file keeps the signatures for the next runs to compare with
+# nothing happens on construction and logging is left to the caller; the HTTP session, DNS cache,
+# robots cache and fetch cache are process-wide, so jobs run one after another or side by side on
+# threads start from the caches the earlier ones warmed up; a cache file is opened by the first job
+# and kept until closeCaches(), a job asking for another file meanwhile raises ValueError
+# each job's outputs are named by its own timestamp (to the second, see claimTimestamp), so jobs
+# writing to the same output_dir side by side do not overwrite each other's files
+class Crawler:
+
+    def __init__(self, source, output_dir='data/output', fetcher=fetchWebsite, parser=parseWebsite, sinks=None,
+                 depth=CRAWL_DEPTH, max_pages=DOMAIN_PAGE_BUDGET, formats=OUTPUT_FORMATS,
+                 normalization=WORD_NORMALIZATION, journal_file=None, resume=False,
+                 robots_cache=ROBOTS_CACHE_FILE, fetch_cache=fetchcache.FETCH_CACHE_FILE, throttle=None,
+                 crawl_workers=CRAWL_WORKERS, parse_workers=PARSE_WORKERS, headers=HEADERS,
+                 dns_prefetch=DNS_PREFETCH, log_file=None, near_duplicates=NEAR_DUPLICATES,
+                 signature_file=None, collapse_duplicates=COLLAPSE_DUPLICATES):
+        self.source = source
+        self.output_dir = output_dir
+        self.fetcher = fetcher
+        self.parser = parser
+        self.sinks = [
+            FileSink(output_dir, formats, institutions=bool(depth), collapse_duplicates=collapse_duplicates)
+        ] if sinks is None else list(sinks)
+        self.depth = depth
+        self.max_pages = max_pages
+        self.normalization = normalization
+        self.follow_links = bool(depth)
+        self.journal_file = journal_file
+        self.resume = resume
+        self.robots_cache = robots_cache
+        self.fetch_cache_file = fetch_cache
+        self.fetch_cache = None
+        self.throttle = throttle or HostThrottle(HOST_DELAY)
+        self.crawl_workers = crawl_workers
+        self.parse_workers = parse_workers
+        self.headers = headers
+        self.dns_prefetch = dns_prefetch
+        self.log_file = log_file
+        self.near_duplicates = near_duplicates
+        self.signature_file = signature_file
+        self.sites = {}
+        self.timestamp = None
+
+
+    ###--------------------------------->>>>>>>
+    # crawls every URL of the source and closes the sinks, returns the job's
+    # {'words': word metrics of the first sink that keeps them, 'sites': collected site details,
+    #  'timestamp', 'outputs': {kind: [paths]} of every file written}
+    # journal_file checkpoints each finished URL, resume=True replays it and only fetches the rest
+    # exceptions are raised to the caller once the journal is closed and the caches are saved
+    def run(self):
+        self.openCaches()
+        self.timestamp = claimTimestamp(self.output_dir)
+        self.sites = {}
+        journal = CrawlJournal(self.journal_file, resume=self.resume) if self.journal_file else None
+
+        try:
+            for sink in self.sinks:
+                sink.open(self.timestamp)
+
+            urls_remaining = self.source
+            if journal:
+                urls_remaining = (
+                    (website, details) for website, details in urls_remaining
+                    if not journal.isCompleted(website)
+                )
+
+            # hosts are resolved in the background as they enter the domain interleaving window
+            if self.dns_prefetch:
+                urls_remaining = resolver.prefetchHosts(urls_remaining)
+            urls_remaining = interleaveDomains(urls_remaining)
+
+            # a link-following crawl takes its URLs from the frontier, which pulls the source URLs as seeds
+            frontier = Frontier(urls_remaining, self.depth, self.max_pages, allowed=self.isAllowed) if self.depth else None
+
+            if journal and self.resume:
+                replayed_links = []
+                for website, details, scraped_data in journal.replay():
+                    self.collect(website, details, scraped_data)
+                    if frontier:
+                        frontier.visit(website)
+                        replayed_links.append((website, details, scraped_data.get('links'), scraped_data.get('url')))
+
+                # links are queued once every replayed page is marked visited, finished pages are not crawled again
+                for website, details, links, url in replayed_links:
+                    frontier.discover(website, details, links, url)
+
+            # a pass ends once no URL is waiting and every fetched page is parsed; links found by the
+            # last pages of a pass start the next one, a plain crawl is a single pass
+            while True:
+                results = crawlWebsites(frontier if frontier else urls_remaining, self.processWebsite, self.crawl_workers)
+
+                # parses the fetched pages on parse_workers processes
+                if self.parse_workers:
+                    parse_task = partial(self.parser, normalization=self.normalization, follow_links=self.follow_links)
+                    results = parseWebsites(results, parse_task, self.parse_workers)
+
+                for website, details, page in results:
+                    scraped_data = page['result'] if page else None
+
+                    # remembers freshly parsed pages for the next run's conditional requests
+                    if scraped_data and self.fetch_cache and not page.get('cached') and not page.get('skipped'):
+                        self.fetch_cache.store(website, page, self.cacheKey())
+
+                    if scraped_data:
+                        if journal:
+                            journal.record(website, details, scraped_data)
+                        self.collect(website, details, scraped_data)
+                        if frontier:
+                            frontier.discover(website, details, scraped_data.get('links'), scraped_data.get('url'))
+
+                if not frontier or not frontier.waiting():
+                    break
+
+        # also when the crawl is interrupted: completed URLs stay in the journal, the outputs are left unwritten
+        finally:
+            if journal:
+                journal.close()
+            self.saveCaches()
+
+        if self.near_duplicates:
+            self.markDuplicates()
+
+        outputs = {}
+        for sink in self.sinks:
+            outputs.update(sink.close(self.sites))
+
+        # converts the log to log-data, only when this job was given the log file to parse
+        if self.log_file and self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            outputs['log-data'] = [executeLogParser(self.log_file, self.output_dir, self.timestamp)]
+
+        word_stats = next((sink.stats() for sink in self.sinks if hasattr(sink, 'stats')), None)
+
+        return {
+            'words': word_stats,
+            'sites': self.sites,
+            'timestamp': self.timestamp,
+            'outputs': outputs
+        }
+
+
+    ###--------------------------------->>>>>>>
+    # hands a finished site to every sink, keeps its details for site-data and the job's result
+    def collect(self, website, details, scraped_data):
+
+        for sink in self.sinks:
+            sink.writeSite(website, details, scraped_data)
+
+        self.sites[website] = {
+            'Category': details['Category'],
+            'State': details['State'],
+            'City': details['City'],
+            'Institution': details['Institution'],
+            **scraped_data['site']
+        }
+
+        # results cached or journaled before signatures were added, or before they were count-weighted, get theirs here
+        if self.near_duplicates and not isSignature(scraped_data['site'].get('signature')):
+            self.sites[website]['signature'] = minhash(scraped_data['words'])
+
+
+    ###--------------------------------->>>>>>>
+    # compares the job's pages with each other and with the earlier runs' pages in signature_file,
+    # a near-duplicate page gets the website it repeats as duplicate_of in its site details
+    def markDuplicates(self):
+        signatures = {website: site.get('signature') for website, site in self.sites.items()}
+        store = SignatureStore(self.signature_file) if self.signature_file else None
+
+        try:
+            duplicates = findDuplicates(signatures, store.load() if store else None)
+
+            for website, canonical in duplicates.items():
+                self.sites[website]['duplicate_of'] = canonical
+
+            if store:
+                store.save(signatures, duplicates, self.timestamp)
+
+        finally:
+            if store:
+                store.close()
+
+        metrics.increment('near_duplicates', len(duplicates))
+        log.info(f'N- Found {len(duplicates)} near-duplicate pages among {len(signatures)} pages')
+        print(f'N- Found {len(duplicates)} near-duplicate pages among {len(signatures)} pages')
+
+
+    ###--------------------------------->>>>>>>
+    # runs on a crawler worker thread: reads site's robots.txt file, then fetches the site if permitted
+    # returns the fetched page for the parse stage, parsed on this thread when parse_workers is 0,
+    # or the cached result when the page has not changed since the last run
+    def processWebsite(self, website, details):
+        log.info(f"Details for website {website}: {details}", extra={'url': website})
+        permissions = robots.checkPermissions(website, ROBOT_RETRY, self.headers['User-Agent'])
+
+        # returns None to skip the fetch according to site's robots.txt file permissions
+        if not permissions.isAllowed(website):
+            metrics.increment('disallowed_skips')
+            log.info(f'Skipping {website} due to disallowed path.', extra={'url': website})
+            #print(f'-Skipping {website} due to disallowed path.')
+            return None
+
+        # rate limiting per domain, replaces the global sleep between sites
+        self.throttle.wait(website.split('/')[2])
+
+        # takes in a URL, sends a request, parses and assembles the response into appropriate data dictionary
+        try:
+            fetch_cache = self.fetch_cache
+            cached = fetch_cache.lookup(website, self.cacheKey()) if fetch_cache else None
+            page = self.fetcher(website, self.headers, fetch_cache.conditionalHeaders(cached) if cached else None)
+
+            if page is None:
+                return None
+
+            # 304 Not Modified, or a body identical to the cached one: no parse needed
+            if cached and (page['status'] == 304 or page.get('content_hash') == cached['content_hash']):
+                metrics.increment('urls_unchanged')
+                log.info(f'F- Unchanged since last run, using cached results for {website}', extra={'url': website})
+                return {'result': fetch_cache.serve(cached), 'cached': True}
+
+            # non-HTML and oversized pages already carry their skippedPage() result
+            if not self.parse_workers and 'result' not in page:
+                page['result'] = self.parser(website, page, self.normalization, self.follow_links)
+                del page['content']
+                log.info(f'Word count completed for {website}', extra={'url': website})
+
+            return page
+
+        except Exception as e:
+            log.error(f"Error scraping {website}: {e}", extra={'url': website})
+            #print(f"Error scraping {website}: {e}")
+            return None
+
+
+    ###--------------------------------->>>>>>>
+    # robots.txt check of a discovered link, the domain's rules are already cached from its seed
+    def isAllowed(self, url):
+        return robots.checkPermissions(url, ROBOT_RETRY, self.headers['User-Agent']).isAllowed(url)
+
+
+    ###--------------------------------->>>>>>>
+    # fetch cache entries of a link-following crawl also keep the page's links, they are cached apart
+    def cacheKey(self):
+        return f'{self.normalization}+links' if self.follow_links else self.normalization
+
+
+    ###--------------------------------->>>>>>>
+    # opens the shared caches or joins the ones already open, which must be the job's cache files:
+    # a job would otherwise read and save another file than the one it was given
+    def openCaches(self):
+        open_files = [('robots cache', self.robots_cache, robots.getRobotsCache(self.robots_cache).filename)]
+        self.fetch_cache = fetchcache.getFetchCache(self.fetch_cache_file) if self.fetch_cache_file else None
+
+        if self.fetch_cache:
+            open_files.append(('fetch cache', self.fetch_cache_file, self.fetch_cache.filename))
+
+        for name, requested, opened in open_files:
+            if os.path.abspath(requested) != os.path.abspath(opened):
+                raise ValueError(f'The {name} `{opened}` is already open in this process, '
+                                 f'jobs share it until closeCaches(): cannot use `{requested}`')
+
+
+    ###--------------------------------->>>>>>>
+    # persists the shared caches without closing them, other jobs may still be using them
+    def saveCaches(self):
+        robots.saveRobotsCache()
+
+        if self.fetch_cache:
+            self.fetch_cache.flush()
+
+
+###--------------------------------->>>>>>>
+# the crawl's file outputs in output_dir: word-data and site-data, and with institutions=True the
+# institution-words and institution-data of a link-following crawl, all under the job's timestamp
+# collapse_duplicates leaves a near-duplicate page's rows out of word-data when the page it repeats
+# is in the same output; the institution totals keep every page
+class FileSink:
+
+    def __init__(self, output_dir='data/output', formats=OUTPUT_FORMATS, institutions=False,
+                 collapse_duplicates=COLLAPSE_DUPLICATES):
+        self.output_dir = output_dir
+        self.formats = formats
+        self.institutions = institutions
+        self.collapse_duplicates = collapse_duplicates
+        self.timestamp = None
+        self.word_writer = None
+        self.institution_writer = None
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def open(self, timestamp):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.timestamp = timestamp
+        self.word_writer = WordDataWriter(
+            os.path.join(self.output_dir, 'word-data.csv'),
+            formats=self.formats,
+            timestamp=timestamp
+        )
+        self.institution_writer = WordDataWriter(
+            os.path.join(self.output_dir, 'institution-words.csv'),
+            formats=self.formats,
+            timestamp=timestamp,
+            key_column='Institution',
+            combine=True
+        ) if self.institutions else None
+
+
+    ###--------------------------------->>>>>>>
+    # streams a site's words to word-data as it finishes
+    def writeSite(self, website, details, scraped_data):
+        self.word_writer.writeSite(website, scraped_data['words'])
+
+        if self.institution_writer:
+            self.institution_writer.writeSite(details['Institution'], scraped_data['words'])
+
+
+    ###--------------------------------->>>>>>>
+    # merges word-data into sorted order, writes and sorts site-data, returns {kind: [paths]}
+    def close(self, sites):
+
+        if self.collapse_duplicates:
+            self.word_writer.dropSites([
+                website for website, site in sites.items() if site.get('duplicate_of') in sites
+            ])
+
+        outputs = {'word-data': self.word_writer.close()}
+
+        outputs['site-data'] = writeSiteData(
+            sites,
+            os.path.join(self.output_dir, 'site-data.csv'),
+            formats=self.formats,
+            timestamp=self.timestamp
+        )
+        for filename in outputs['site-data']:
+            sortDataFile(filename, ['Website'], 'Site-data')
+
+        # per-institution word counts and page totals of a link-following crawl
+        if self.institution_writer:
+            outputs['institution-words'] = self.institution_writer.close()
+            outputs['institution-data'] = writeInstitutionData(
+                sites,
+                os.path.join(self.output_dir, 'institution-data.csv'),
+                formats=self.formats,
+                timestamp=self.timestamp
+            )
+
+        return outputs
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def stats(self):
+        return self.word_writer.stats()
+
+
+###--------------------------------->>>>>>>
+# keeps each site's {word: count} in memory instead of writing files, for callers that use the
+# results directly; words holds the last result of a URL crawled more than once
+class MemorySink:
+
+    def __init__(self):
+        self.words = {}
+        self.timestamp = None
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def open(self, timestamp):
+        self.timestamp = timestamp
+        self.words = {}
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def writeSite(self, website, details, scraped_data):
+        self.words[website] = scraped_data['words']
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self, sites):
+        return {}
+
+
+###--------------------------------->>>>>>>
+# saves and closes the process-wide caches shared by the jobs, once no job is running
+# the next job opens its own cache files
+def closeCaches():
+    resolver.closeDnsCache()
+    robots.closeRobotsCache()
+    fetchcache.closeFetchCache()
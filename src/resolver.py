@@ -0,0 +1,157 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging as log
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib3.util.connection import allowed_gai_family
+import metrics
+
+DNS_TTL = 300           # seconds a resolved host is reused, the system resolver does not report record TTLs
+NEGATIVE_TTL = 60       # seconds a failed lookup is remembered, the robots.txt probes and the page fetch fail at once
+PREFETCH_WORKERS = 8
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+
+###--------------------------------->>>>>>>
+# host -> addresses cache in front of the system resolver, shared by every connection of the HTTP session
+# a host is looked up once while its entry lives, concurrent lookups of the same host wait for the first one,
+# and failures are cached as well; prefetch() resolves hosts on background threads ahead of their fetch
+class DnsCache:
+
+    def __init__(self, ttl=DNS_TTL, negative_ttl=NEGATIVE_TTL, workers=PREFETCH_WORKERS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.workers = workers
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.pool = None
+
+
+    ###--------------------------------->>>>>>>
+    # addresses of host in getaddrinfo order, raises socket.gaierror for a host that does not resolve
+    # a prefetch still waiting in the queue is taken over, the fetch does not wait behind other hosts' lookups
+    def resolve(self, host):
+
+        with self.lock:
+            future, expires, task = self.entries.get(host, (None, None, None))
+
+            if future is None or (expires is not None and expires <= time.monotonic()):
+                future = Future()
+                self.entries[host] = (future, None, None)
+                owner = True
+            elif task is not None and task.cancel():
+                self.entries[host] = (future, None, None)
+                owner = True
+            else:
+                owner = False
+
+        if owner:
+            metrics.increment('dns_cache_misses')
+            self.lookup(host, future)
+        else:
+            metrics.increment('dns_cache_hits')
+
+        # a fresh exception each time, re-raising the cached one would keep extending its traceback
+        error = future.exception()
+        if error is not None:
+            raise socket.gaierror(*error.args)
+
+        return future.result()
+
+
+    ###--------------------------------->>>>>>>
+    # queues a background lookup of host unless it is cached or already being resolved
+    def prefetch(self, host):
+
+        with self.lock:
+            future, expires, _ = self.entries.get(host, (None, None, None))
+
+            if future is not None and (expires is None or expires > time.monotonic()):
+                return
+
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dns')
+
+            future = Future()
+            self.entries[host] = (future, None, self.pool.submit(self.lookup, host, future))
+
+        metrics.increment('dns_prefetched')
+
+
+    ###--------------------------------->>>>>>>
+    # resolves host into future, which stays in the cache for the positive or negative TTL
+    def lookup(self, host, future):
+
+        try:
+            with metrics.timer('dns'):
+                infos = socket.getaddrinfo(host, None, allowed_gai_family(), socket.SOCK_STREAM)
+            future.set_result(list(dict.fromkeys(info[4][0] for info in infos)))
+            ttl = self.ttl
+
+        except OSError as e:
+            metrics.increment('dns_failures')
+            log.warning(f'D- Could not resolve {host}: {e}')
+            future.set_exception(e if isinstance(e, socket.gaierror) else socket.gaierror(str(e)))
+            ttl = self.negative_ttl
+
+        with self.lock:
+            self.entries[host] = (future, time.monotonic() + ttl, None)
+
+
+    ###--------------------------------->>>>>>>
+    # drops the prefetches that have not started yet, used at the end of a run
+    def close(self):
+
+        with self.lock:
+            pool, self.pool = self.pool, None
+
+            if pool is None:
+                return
+
+            pool.shutdown(wait=False, cancel_futures=True)
+
+            for host, (future, _, task) in list(self.entries.items()):
+                if task is not None and task.cancelled():
+                    del self.entries[host]
+                    future.set_exception(socket.gaierror(f'lookup of {host} cancelled'))
+
+
+###--------------------------------->>>>>>>
+# returns the process-wide DNS cache, building it on first use
+def getDnsCache():
+    global _dns_cache
+
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DnsCache()
+
+    return _dns_cache
+
+
+###--------------------------------->>>>>>>
+#
+def resolve(host):
+    return getDnsCache().resolve(host)
+
+
+###--------------------------------->>>>>>>
+# passes (website, details) items through unchanged, resolving each new host in the background as it goes by
+# placed before the domain interleaving window, hosts are looked up while earlier URLs are still being fetched
+def prefetchHosts(items):
+    dns_cache = getDnsCache()
+
+    for website, details in items:
+        host = urlsplit(website).hostname
+        if host:
+            dns_cache.prefetch(host)
+        yield website, details
+
+
+###--------------------------------->>>>>>>
+#
+def closeDnsCache():
+
+    if _dns_cache is not None:
+        _dns_cache.close()
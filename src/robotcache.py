@@ -0,0 +1,119 @@
+import json
+import logging as log
+import os
+import threading
+import time
+
+ROBOTS_CACHE_FILE = 'data/cache/robots-cache.json'
+ROBOTS_CACHE_TTL = 24 * 60 * 60
+ROBOTS_NEGATIVE_TTL = 60 * 60
+
+class RobotsCache:
+
+    def __init__(self, filename=ROBOTS_CACHE_FILE, ttl=ROBOTS_CACHE_TTL, negative_ttl=ROBOTS_NEGATIVE_TTL):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # domain -> {'fetched': epoch seconds, 'groups': parsed user-agent groups, None when the site has no robots.txt}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.domain_locks = {}
+        self.load()
+
+
+    ###--------------------------------->>>>>>>
+    # reads unexpired entries persisted by earlier runs
+    def load(self):
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+
+            self.entries = {
+                domain: entry for domain, entry in stored.items()
+                if 'groups' in entry and not self.isExpired(entry)
+            }
+            log.info(f'R- Loaded {len(self.entries)} cached robots.txt entries from `{self.filename}`')
+
+        except Exception as e:
+            log.warning(f'R- Ignoring unreadable robots cache `{self.filename}`: {e}')
+
+
+    ###--------------------------------->>>>>>>
+    # writes the cache back to disk so the next run can skip the network
+    def save(self):
+
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+            with self.lock:
+                entries = {
+                    domain: entry for domain, entry in self.entries.items()
+                    if not self.isExpired(entry)
+                }
+
+            with open(self.filename, 'w', encoding='utf-8') as file:
+                json.dump(entries, file)
+
+            log.info(f'R- Saved {len(entries)} robots.txt entries to `{self.filename}`')
+
+        except Exception as e:
+            log.error(f'R- Failed to save robots cache `{self.filename}`: {e}')
+
+
+    ###--------------------------------->>>>>>>
+    # negative results ("no robots.txt") expire sooner, a failed fetch may only be temporary
+    def isExpired(self, entry):
+        ttl = self.ttl if entry['groups'] is not None else self.negative_ttl
+        return time.time() - entry['fetched'] > ttl
+
+
+    ###--------------------------------->>>>>>>
+    # one lock per domain, so concurrent workers on the same site wait for a single fetch
+    def domainLock(self, domain):
+
+        with self.lock:
+            return self.domain_locks.setdefault(domain, threading.Lock())
+
+
+    ###--------------------------------->>>>>>>
+    # returns (found, groups) and counts the lookup as a hit or a miss
+    def lookup(self, domain):
+
+        with self.lock:
+            entry = self.entries.get(domain)
+
+            if entry is not None and not self.isExpired(entry):
+                self.hits += 1
+                return True, entry['groups']
+
+            self.misses += 1
+            return False, None
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def store(self, domain, groups):
+
+        with self.lock:
+            self.entries[domain] = {
+                'fetched': time.time(),
+                'groups': groups
+            }
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def stats(self):
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'domains': len(self.entries)
+            }
@@ -1,5 +1,16 @@
 import logging as log
+import re
+import threading
+import time
 import requests
+import metrics
+from robotcache import ROBOTS_CACHE_FILE, RobotsCache
+from session import fetch
+
+_robots_cache = None
+_robots_cache_lock = threading.Lock()
+_robots_stats = {'hits': 0, 'misses': 0, 'domains': 0}
+_matchers = {}
 
 ###--------------------------------->>>>>>>
 # 
@@ -21,51 +32,226 @@ def robotCheckpoint(domain, ROBOT_RETRY):
 
         for attempt in range(ROBOT_RETRY):
             try:
-                response = requests.get(paperwork, timeout=5)
+                started = time.perf_counter()
+                response = fetch(paperwork, timeout=5)
                 response.raise_for_status()  # Raise an error for bad responses
-                log.info(f'R- Successfully read robots.txt from {paperwork}')
+                log.info(f'R- Successfully read robots.txt from {paperwork}', extra={
+                    'url': paperwork,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+                })
+                metrics.increment('robots_fetched')
+                metrics.increment('bytes_robots', len(response.content))
                 return response.text
             
+            # the session's transport already retried the connection (session.TRANSPORT_RETRY),
+            # trying it again here would multiply the attempts on an unreachable host
+            except requests.exceptions.ConnectTimeout as e:
+                metrics.increment('robots_timeouts')
+                log.warning(f'R- Could not connect to {paperwork}: {e}, trying next protocol...', extra={'url': paperwork})
+                break
+
             except requests.exceptions.Timeout:
+                metrics.increment('robots_timeouts')
                 log.warning(f'R- Timeout occurred while fetching {paperwork}. Attempt {attempt + 1} of {ROBOT_RETRY}.')
                 if attempt + 1 == ROBOT_RETRY:
                     log.warning(f'R- Giving up on {paperwork} after {ROBOT_RETRY} attempts.')
                     #print(f'R- Giving up on {paperwork} after {ROBOT_RETRY} attempts.')
             
             except requests.exceptions.RequestException as e:
-                log.warning(f'R- Failed to find {paperwork}: {e}, trying next protocol...')
+                log.warning(f'R- Failed to find {paperwork}: {e}, trying next protocol...', extra={'url': paperwork})
                 break   
 
+    metrics.increment('robots_missing')
     log.warning(f'R- Failed to obtain robots.txt for domain {domain} using both HTTP and HTTPS.')
     #print(f'R- Failed to obtain robots.txt for domain {domain} using both HTTP and HTTPS.')
     return None
 
 
 ###--------------------------------->>>>>>>
-# 
-def checkPermissions(url, ROBOT_RETRY):
+# returns the run's robots cache, loading persisted entries from data/cache/ on first use
+# filename only applies to that first call, which opens the cache
+def getRobotsCache(filename=ROBOTS_CACHE_FILE):
+    global _robots_cache
+
+    with _robots_cache_lock:
+        if _robots_cache is None:
+            _robots_cache = RobotsCache(filename)
+
+    return _robots_cache
+
+
+###--------------------------------->>>>>>>
+# persists the robots cache at the end of a run
+def saveRobotsCache():
+
+    if _robots_cache is not None:
+        _robots_cache.save()
+
+
+###--------------------------------->>>>>>>
+# saves and closes the robots cache, the next getRobotsCache() opens its file again
+def closeRobotsCache():
+    global _robots_cache, _robots_stats
+
+    with _robots_cache_lock:
+        if _robots_cache is not None:
+            _robots_cache.save()
+            _robots_stats = _robots_cache.stats()
+            _robots_cache = None
+
+
+###--------------------------------->>>>>>>
+# robots cache hit/miss counts for the diagnostic summary, kept after the cache is closed
+def cacheStats():
+
+    if _robots_cache is None:
+        return _robots_stats
+
+    return _robots_cache.stats()
+
+
+###--------------------------------->>>>>>>
+# returns the compiled RobotRules for the URL's domain and the given user agent
+def checkPermissions(url, ROBOT_RETRY, user_agent='*'):
     domain = url.split('/')[2]
+    agent = agentToken(user_agent)
+    cache = getRobotsCache()
+
+    # fetches robots.txt once per domain, later URLs on the same domain are served from the cache
+    with cache.domainLock(domain):
+        found, groups = cache.lookup(domain)
+
+        if not found:
+            groups = readPermissions(domain, ROBOT_RETRY)
+            cache.store(domain, groups)
+            _matchers.pop((domain, agent), None)
+
+        # compiled once per domain and agent, reused for every URL on the domain
+        matcher = _matchers.get((domain, agent))
+        if matcher is None:
+            matcher = RobotRules(selectRules(groups or [], agent))
+            _matchers[(domain, agent)] = matcher
+
+    return matcher
+
+
+###--------------------------------->>>>>>>
+# fetches and parses a domain's robots.txt, returns None when the site has none
+def readPermissions(domain, ROBOT_RETRY):
     checkpoint = robotCheckpoint(domain, ROBOT_RETRY)
 
     if checkpoint is None:
         log.warning(f'R- No robots.txt found for {domain}, assuming no restrictions.')
         #print(f'R- No robots.txt found for {domain}, assuming no restrictions.')
-        return[]
-        
-    rules = checkpoint.splitlines()
-    user_agent = '*'
-    disallow_paths = []
+        return None
 
-    for line in rules:
-        line = line.strip()
+    groups = parseRobots(checkpoint)
+    rule_count = sum(len(group['rules']) for group in groups)
+    log.info('R- Parsed %d rules in %d user-agent groups for domain %s', rule_count, len(groups), domain)
+    return groups
 
-        if line.startswith('User-agent:'):
-            user_agent = line.split(':')[1].strip()
-        
-        elif line.startswith('Disallow:'):
-            if user_agent =='*':
-                disallow_paths.append(line.split(':')[1].strip())
-    
-    log.info('R- Disallowed paths for domain %s: %s', domain, ', '.join(disallow_paths) if disallow_paths else 'None')
-    #print('R- Disallowed paths for domain %s: %s', domain, ', '.join(disallow_paths) if disallow_paths else 'None')
-    return disallow_paths
+
+###--------------------------------->>>>>>>
+# splits robots.txt into user-agent groups: [{'agents': [...], 'rules': [[allow, path], ...]}]
+# consecutive User-agent lines share one group, empty Allow/Disallow values are not rules
+def parseRobots(text):
+    groups = []
+    group = None
+    in_rules = False
+
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+
+        if ':' not in line:
+            continue
+
+        field, value = line.split(':', 1)
+        field = field.strip().lower()
+        value = value.strip()
+
+        if field == 'user-agent':
+            if group is None or in_rules:
+                group = {'agents': [], 'rules': []}
+                groups.append(group)
+                in_rules = False
+            group['agents'].append(value.lower())
+
+        elif field in ('allow', 'disallow') and group is not None:
+            in_rules = True
+            if value:
+                group['rules'].append([field == 'allow', value])
+
+    return groups
+
+
+###--------------------------------->>>>>>>
+# merges the groups naming the agent's product token, falling back to the `*` groups
+def selectRules(groups, agent):
+    matched = [group for group in groups if agent in group['agents']]
+
+    if not matched:
+        matched = [group for group in groups if '*' in group['agents']]
+
+    return [rule for group in matched for rule in group['rules']]
+
+
+###--------------------------------->>>>>>>
+# 'Mozilla/5.0 (...)' -> 'mozilla'
+def agentToken(user_agent):
+    return user_agent.split('/')[0].split()[0].lower() if user_agent.strip() else '*'
+
+
+###--------------------------------->>>>>>>
+# a domain's Allow/Disallow rules compiled into tiers of equal rule length, longest first
+# plain prefixes are found with one dict lookup per tier, only `*`/`$` rules run a regex
+class RobotRules:
+
+    def __init__(self, rules):
+        tiers = {}
+
+        for allow, path in rules:
+            prefixes, wildcards = tiers.setdefault(len(path), ({}, []))
+
+            if '*' in path or path.endswith('$'):
+                wildcards.append((re.compile(self.toRegex(path)), allow))
+            else:
+                # Allow wins a tie between rules of the same path
+                prefixes[path] = prefixes.get(path, False) or allow
+
+        self.rule_count = len(rules)
+        self.tiers = [(length, *tiers[length]) for length in sorted(tiers, reverse=True)]
+
+
+    ###--------------------------------->>>>>>>
+    # `*` matches any run of characters, a trailing `$` anchors the end of the path
+    @staticmethod
+    def toRegex(path):
+        anchored = path.endswith('$')
+        if anchored:
+            path = path[:-1]
+
+        regex = '.*'.join(re.escape(part) for part in path.split('*'))
+        return regex + r'\Z' if anchored else regex
+
+
+    ###--------------------------------->>>>>>>
+    # the longest matching rule decides, Allow wins ties, no matching rule means allowed
+    def isAllowed(self, url):
+
+        if not self.tiers:
+            return True
+
+        # path plus query string, scheme and host are not part of a robots.txt rule
+        path = '/' + url.split('/', 3)[3].split('#', 1)[0] if url.count('/') > 2 else '/'
+
+        for length, prefixes, wildcards in self.tiers:
+            decision = prefixes.get(path[:length])
+
+            for regex, allow in wildcards:
+                if decision is not True and regex.match(path):
+                    decision = allow if decision is None else allow or decision
+
+            if decision is not None:
+                return decision
+
+        return True
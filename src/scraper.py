@@ -1,70 +1,225 @@
+import codecs
 import logging as log
+import re
+import time
 import requests
-from bs4 import BeautifulSoup
+import metrics
+from extractor import extractChunks, skippedPage
+from fetchcache import contentHash
+from neardup import minhash
+from session import fetch
+from tokenizer import NORMALIZATION
+
+MAX_BODY_BYTES = 10 * 1024 * 1024      # larger responses are not downloaded or parsed
+CHUNK_BYTES = 64 * 1024
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')     # a response without Content-Type is read too
+SNIFF_BYTES = 1024      # where a <meta charset> is looked for
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16')
+]
 
 ###--------------------------------->>>>>>>
-#
-def scrapeWebsite(website, HEADERS):
+# fetch and parse in one call, used when no parser process pool is running
+def scrapeWebsite(website, HEADERS, normalization=NORMALIZATION):
+    raw_page = fetchWebsite(website, HEADERS)
+
+    if raw_page is None:
+        return None
+
+    scraped_data = parseWebsite(website, raw_page, normalization)
+    log.info(f'Word count completed for {website}', extra={'url': website})
+    #print(f'Word count completed for {website}')
+    return scraped_data
+
+
+###--------------------------------->>>>>>>
+# fetch stage: streams the response body in CHUNK_BYTES pieces and returns it with its encoding and
+# cache validators, parsing happens in parseWebsite(); conditional_headers come from the fetch cache
+# non-HTML and oversized responses are not read, they come back with a skippedPage() result
+# records time to first byte ('ttfb') and body download time ('download') per URL
+def fetchWebsite(website, HEADERS, conditional_headers=None):
+    metrics.increment('urls_attempted')
 
     try:
         # send an HTTP request to the provided URL with specified headers
-        log.info(f'Sending HTTP request to {website}')
+        log.info(f'Sending HTTP request to {website}', extra={'url': website})
         print(f'Sending HTTP request to {website}')
         
-        response = requests.get(website, headers=HEADERS)
-        response.raise_for_status()
-        
-        log.info(f'Successfully fetched {website}')
-        #print(f'Successfully fetched {website}')
+        started = time.perf_counter()
+        response = fetch(website, headers={**HEADERS, **(conditional_headers or {})}, stream=True)
+        metrics.observe('ttfb', response.elapsed.total_seconds() * 1000)
 
-        # parse the HTML content response
-        soup = BeautifulSoup(response.text, 'lxml')
-
-        # extract and process the text content (for -> word-data.csv)
-        # store text content data in word_count dictionary
-        text_content = soup.get_text(separator=' ')
-        word_count = {}
-        for word in text_content.split():
-            word = word.lower().strip('.,!?')
-            word_count[word] = word_count.get(word, 0) + 1
-        log.info(f'Word count completed for {website}')
-        #print(f'Word count completed for {website}')
-
-        # extract site details (for -> site-data.csv)
-        image_count = len(soup.find_all('img'))
-        link_count = len(soup.find_all('a'))
-        form_count = len(soup.find_all('form'))
-        css_count = len(soup.find_all('link', rel='stylesheet'))
-        js_count = len(soup.find_all('script', src=True))
-        '''placeholder for certificate information'''
-        cert_info = 'N/A'
-        host_info = 'N/A'
-        title = soup.find('meta', attrs={'name': 'title'}).get('content', '').strip() \
-            if soup.find('meta', attrs={'name': 'title'}) else 'N/A'
-        description = soup.find('meta', attrs={'name': 'description'})['content'] \
-            if soup.find('meta', attrs={'name': 'description'}) else 'N/A'
-        
-        # store site details and analytics in site_details dictionary
-        site_details = {
-            'images': image_count,
-            'links': link_count,
-            'forms': form_count,
-            'stylesheets': css_count,
-            'scripts': js_count,
-            'cert': cert_info,
-            'host': host_info,
-            'title': title,
-            'description': description,
-        }
+        with response:
+            response.raise_for_status()
+
+            # reading the empty body hands the connection back to the pool
+            if response.status_code == 304:
+                response.content
+                metrics.increment('urls_not_modified')
+                log.info(f'Successfully fetched {website} (not modified)', extra={
+                    'url': website,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+                })
+                return {'status': 304}
+
+            content_type, charset = parseContentType(response.headers.get('Content-Type'))
+
+            if content_type and content_type not in HTML_CONTENT_TYPES:
+                metrics.increment('urls_skipped_content_type')
+                log.info(f'Skipping {website}, content type {content_type} is not HTML', extra={'url': website})
+                return skippedResponse(response, f'non-html: {content_type}')
+
+            if int(response.headers.get('Content-Length') or 0) > MAX_BODY_BYTES:
+                return oversizedResponse(website, response)
+
+            with metrics.timer('download'):
+                chunks = []
+                size = 0
+                encoding = None
+
+                for chunk in response.iter_content(CHUNK_BYTES):
+                    # the charset is settled on the first chunk, before the rest of the body arrives
+                    if encoding is None:
+                        encoding = detectEncoding(chunk, charset)
+
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > MAX_BODY_BYTES:
+                        return oversizedResponse(website, response)
+
+                content = b''.join(chunks)
+
+        metrics.increment('urls_fetched')
+        metrics.increment('bytes_downloaded', len(content))
+        log.info(f'Successfully fetched {website}', extra={
+            'url': website,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+        #print(f'Successfully fetched {website}')
 
-        # return a dictionary of dictionaries
         return {
-            'words': word_count,
-            'site': site_details
+            'status': response.status_code,
+            'url': response.url,
+            'content': content,
+            'encoding': encoding or 'utf-8',
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': contentHash(content)
         }
     
     # handle and log request errors if any
     except requests.exceptions.RequestException as e:
-        log.error(f'Error fetching {website}: {e}')
+        metrics.increment('fetch_errors')
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            metrics.increment('url_timeouts')
+        log.error(f'Error fetching {website}: {e}', extra={'url': website})
         #print(f'Error fetching {website}: {e}')
-        return None
\ No newline at end of file
+        return None
+
+
+###--------------------------------->>>>>>>
+# a fetched page that is not parsed, the reason goes to site-data's FetchStatus column
+# marked 'skipped' so the fetch cache does not keep it
+def skippedResponse(response, status):
+    return {'status': response.status_code, 'result': skippedPage(status), 'skipped': True}
+
+
+###--------------------------------->>>>>>>
+# the connection is closed rather than drained, the rest of the body is never downloaded
+def oversizedResponse(website, response):
+    metrics.increment('urls_oversized')
+    log.warning(f'Skipping {website}, body is larger than {MAX_BODY_BYTES} bytes', extra={'url': website})
+    return skippedResponse(response, 'oversized')
+
+
+###--------------------------------->>>>>>>
+# 'text/html; charset=UTF-8' -> ('text/html', 'UTF-8'), (None, None) without a header
+def parseContentType(header):
+
+    if not header:
+        return None, None
+
+    content_type, *params = header.split(';')
+    charset = None
+
+    for param in params:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            charset = value.strip().strip('"\'') or None
+
+    return content_type.strip().lower() or None, charset
+
+
+###--------------------------------->>>>>>>
+# encoding of a body from its first chunk: byte order mark, then the charset of the Content-Type header,
+# then a <meta charset> in the first SNIFF_BYTES, then charset_normalizer's guess on the chunk
+def detectEncoding(head, charset=None):
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    match = META_CHARSET.search(head[:SNIFF_BYTES])
+    for candidate in (charset, match.group(1).decode('ascii') if match else None):
+        if candidate:
+            try:
+                return codecs.lookup(candidate).name
+            except LookupError:
+                pass
+
+    import charset_normalizer
+    guess = charset_normalizer.from_bytes(head).best()
+    return guess.encoding if guess else 'utf-8'
+
+
+###--------------------------------->>>>>>>
+# parse stage: CPU-bound, runs in a parser worker process and returns the compact {'words', 'site'} result
+# the body is decoded and fed to the parser CHUNK_BYTES at a time, the decoded page is never one string
+# follow_links adds the page's links to the result, resolved against the URL the page was served from,
+# and that URL (after redirects) as result['url']
+# the page's near-duplicate signature is added to the site details, see neardup.py
+def parseWebsite(website, raw_page, normalization=NORMALIZATION, follow_links=False):
+    content = raw_page['content']
+    encoding = raw_page['encoding'] or detectEncoding(content[:CHUNK_BYTES])
+    base_url = raw_page.get('url', website) if follow_links else None
+
+    # parse the HTML content response in one streaming pass: words, tag counts and meta fields
+    result = extractChunks(decodeChunks(content, encoding), normalization, base_url)
+    if follow_links:
+        result['url'] = base_url
+
+    with metrics.timer('signature'):
+        result['site']['signature'] = minhash(result['words'])
+
+    return result
+
+
+###--------------------------------->>>>>>>
+# incremental decode, a multi-byte character split between two slices is carried over
+# the time spent decoding is observed once per page into the 'decode' histogram
+def decodeChunks(content, encoding):
+
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    elapsed = 0.0
+    view = memoryview(content)
+
+    for start in range(0, len(content), CHUNK_BYTES):
+        started = time.perf_counter()
+        text = decoder.decode(view[start:start + CHUNK_BYTES])
+        elapsed += time.perf_counter() - started
+        yield text
+
+    started = time.perf_counter()
+    text = decoder.decode(b'', final=True)
+    elapsed += time.perf_counter() - started
+    metrics.observe('decode', elapsed * 1000)
+    yield text
@@ -0,0 +1,137 @@
+import logging as log
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, NewConnectionError
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+import metrics
+import resolver
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+TRANSPORT_RETRY = 2
+RETRY_BACKOFF = .5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+POOL_HOSTS = 100
+POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+###--------------------------------->>>>>>>
+# new connections are timed into the 'connect' histogram (DNS lookup, TCP and TLS handshakes),
+# reused keep-alive connections do not connect again
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        with metrics.timer('connect'):
+            connectResolved(self, super().connect)
+        metrics.increment('connections_opened')
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        with metrics.timer('connect'):
+            connectResolved(self, super().connect)
+        metrics.increment('connections_opened')
+
+
+###--------------------------------->>>>>>>
+# connects to the host's addresses from the shared DNS cache (resolver.py) in order, the next one
+# is tried when a connection is refused; TLS still verifies and sends SNI for the host name
+def connectResolved(connection, connect):
+    host = connection._dns_host
+
+    try:
+        addresses = resolver.resolve(host)
+    except OSError as e:
+        raise NameResolutionError(connection.host, connection, e) from e
+
+    try:
+        for index, address in enumerate(addresses):
+            connection._dns_host = address
+            try:
+                return connect()
+            except NewConnectionError:
+                if index + 1 == len(addresses):
+                    raise
+
+    finally:
+        connection._dns_host = host
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+###--------------------------------->>>>>>>
+# HTTPAdapter whose pools open timed connections
+class TimedHTTPAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+
+###--------------------------------->>>>>>>
+# returns the process-wide HTTP session shared by scraper.py and robots.py, building it on first use
+def getSession():
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = buildSession()
+
+    return _session
+
+
+###--------------------------------->>>>>>>
+# keep-alive connection pools per host, transport-level retries with backoff, gzip/brotli negotiation
+def buildSession():
+    retry = Retry(
+        total=TRANSPORT_RETRY,
+        connect=TRANSPORT_RETRY,
+        read=0,
+        status=TRANSPORT_RETRY,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=('GET', 'HEAD'),
+        raise_on_status=False
+    )
+    adapter = TimedHTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=POOL_SIZE,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # urllib3 only advertises `br` when the Brotli package is installed
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    log.info(f'S- HTTP session ready, Accept-Encoding: {ACCEPT_ENCODING}')
+    return session
+
+
+###--------------------------------->>>>>>>
+# sends a GET through the shared session, always with a (connect, read) timeout
+# with stream=True the call returns once the headers are in and the body is read by the caller
+def fetch(url, headers=None, timeout=None, stream=False):
+
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    return getSession().get(url, headers=headers, timeout=timeout, stream=stream)
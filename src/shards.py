@@ -0,0 +1,410 @@
+from collections import Counter
+import csv
+import glob
+import hashlib
+import heapq
+from itertools import groupby
+import json
+import logging as log
+import os
+import metrics
+from diagnostics import Diagnostics
+from logparser import LOG_FIELDS
+from neardup import SIGNATURE_FILE, SignatureStore, findDuplicates
+from utility import INSTITUTION_DATA_COLUMNS, claimTimestamp
+from wordindex import runTimestamp
+
+SHARD_ROOT = 'data/output/shards'
+MERGE_OUTPUT = 'data/output'
+
+###--------------------------------->>>>>>>
+# a shard of a crawl split across shard_count processes or machines: shard index/count are 0-based
+# every URL of a domain lands in the same shard, so robots.txt and host rate limits stay per shard
+def shardName(index, count):
+    return f'shard-{index}-of-{count}'
+
+
+###--------------------------------->>>>>>>
+# stable domain -> shard assignment, independent of input order and Python's hash seed
+def shardOf(domain, count):
+    digest = hashlib.blake2b(domain.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % count
+
+
+###--------------------------------->>>>>>>
+# keeps the (website, details) items of one shard
+def selectShard(items, index, count):
+
+    for website, details in items:
+        if shardOf(website.split('/')[2], count) == index:
+            yield website, details
+
+
+###--------------------------------->>>>>>>
+# per-shard name of a run file: logs/scraper.log -> logs/scraper-shard-0-of-4.log
+# shard processes running side by side do not share logs, journals or caches
+def shardFile(filename, index, count):
+    base, ext = os.path.splitext(filename)
+    return f'{base}-{shardName(index, count)}{ext}'
+
+
+###--------------------------------->>>>>>>
+# output directory of one shard's partial word-data, site-data, log-data and summary files
+def shardOutput(index, count, shard_root=SHARD_ROOT):
+    return os.path.join(shard_root, shardName(index, count))
+
+
+###--------------------------------->>>>>>>
+# timestamp of the latest complete run (word-data and site-data written) in a shard directory,
+# None when the shard has not finished a run; runs are ordered by the timestamp in their file names
+def latestShardRun(directory):
+    word_runs = {runTimestamp(path) for path in glob.glob(os.path.join(directory, '*-word-data.csv'))}
+    site_runs = {runTimestamp(path) for path in glob.glob(os.path.join(directory, '*-site-data.csv'))}
+    complete = word_runs & site_runs
+
+    return max(complete) if complete else None
+
+
+###--------------------------------->>>>>>>
+# a shard run's file of a kind, None when the run did not write it
+def shardRunFile(directory, timestamp, kind):
+    filename = os.path.join(directory, f'{timestamp}-{kind}')
+    return filename if os.path.exists(filename) else None
+
+
+###--------------------------------->>>>>>>
+# combines the outputs of the shards 0 .. shard_count - 1 of a shard_count-way crawl under shard_root
+# into one run in output_dir, taking each shard's latest complete run (by the timestamp in its file
+# names), every file of a shard comes from that one run; other shard counts' directories are left out,
+# and nothing is merged while a shard has no complete run
+# word-data and site-data are k-way merged (each shard's files are already sorted), as are the
+# institution files of a --depth crawl with the counts of an institution in several shards added up,
+# log-data is merged by timestamp, event metrics and histograms are added up, and the diagnostic summary
+# is written for the combined run; rows are streamed, no shard file is loaded whole
+# returns the {kind: [paths]} of the combined run, None when there was nothing to merge
+def mergeShards(shard_count, shard_root=SHARD_ROOT, output_dir=MERGE_OUTPUT, signature_file=SIGNATURE_FILE):
+    shard_runs = []
+    missing = []
+
+    for index in range(shard_count):
+        directory = shardOutput(index, shard_count, shard_root)
+        timestamp = latestShardRun(directory)
+
+        if timestamp is None:
+            missing.append(shardName(index, shard_count))
+        else:
+            shard_runs.append((shardName(index, shard_count), directory, timestamp))
+
+    if missing:
+        log.error(f'M- No complete outputs of {", ".join(missing)} in `{shard_root}`, nothing merged')
+        print(f'M- No complete outputs of {", ".join(missing)} in `{shard_root}`, nothing merged')
+        return None
+
+    for shard, _, run in shard_runs:
+        log.info(f'M- Merging run {run} of {shard}')
+
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = claimTimestamp(output_dir)
+
+    outputs = {
+        kind: [os.path.join(output_dir, f'{timestamp}-{kind}.csv')]
+        for kind in ('word-data', 'site-data', 'log-data')
+    }
+
+    word_stats = mergeWordData(
+        [shardRunFile(directory, run, 'word-data.csv') for _, directory, run in shard_runs],
+        outputs['word-data'][0]
+    )
+    duplicates = mergeDuplicates(
+        [(shardFile(signature_file, index, shard_count), run) for index, (_, _, run) in enumerate(shard_runs)]
+    ) if signature_file else None
+    near_duplicates = mergeSiteData(
+        [shardRunFile(directory, run, 'site-data.csv') for _, directory, run in shard_runs],
+        outputs['site-data'][0],
+        duplicates
+    )
+    mergeLogData(
+        [(shard, shardRunFile(directory, run, 'log-data.csv')) for shard, directory, run in shard_runs],
+        outputs['log-data'][0]
+    )
+
+    # institution files are only written by link-following (--depth) crawls
+    institution_words = [shardRunFile(directory, run, 'institution-words.csv') for _, directory, run in shard_runs]
+    institution_data = [shardRunFile(directory, run, 'institution-data.csv') for _, directory, run in shard_runs]
+
+    if any(institution_words):
+        outputs['institution-words'] = [os.path.join(output_dir, f'{timestamp}-institution-words.csv')]
+        mergeInstitutionWords(institution_words, outputs['institution-words'][0])
+
+    if any(institution_data):
+        outputs['institution-data'] = [os.path.join(output_dir, f'{timestamp}-institution-data.csv')]
+        mergeInstitutionData(institution_data, outputs['institution-data'][0])
+
+    runtime = Diagnostics(output_dir)
+    runtime.recordOutputFiles(outputs)
+    runtime.recordWordMetrics(word_stats)
+    runtime.recordNearDuplicates(near_duplicates)
+    mergeShardSummaries(
+        [shardRunFile(directory, run, 'diagnostic-summary.json') for _, directory, run in shard_runs],
+        runtime
+    )
+    runtime.recordEventMetrics(mergeEventMetrics(
+        [shardRunFile(directory, run, 'event-metrics.json') for _, directory, run in shard_runs]
+    ))
+    runtime.summary()
+
+    log.info(f'M- Merged {shard_count} shards from `{shard_root}` into `{output_dir}`')
+    print(f'M- Merged {shard_count} shards from `{shard_root}` into `{output_dir}`')
+    return outputs
+
+
+###--------------------------------->>>>>>>
+# heap merge of the shards' word-data by (Website, Word), word metrics are taken while the rows go by
+def mergeWordData(word_files, filename):
+    vocabulary = Counter()
+    site_words = Counter()
+    site_counts = Counter()
+    rows = 0
+    inputs = [open(word_file, 'r', newline='', encoding='utf-8') for word_file in word_files]
+
+    try:
+        readers = [csv.reader(file) for file in inputs]
+        for reader in readers:
+            next(reader, None)
+
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow(['Website', 'Word', 'Count'])
+
+            for website, word, count in heapq.merge(*readers, key=lambda row: (row[0], row[1])):
+                writer.writerow([website, word, count])
+                count = int(count)
+                vocabulary[word] += count
+                site_words[website] += 1
+                site_counts[website] += count
+                rows += 1
+
+    finally:
+        for file in inputs:
+            file.close()
+
+    log.info(f'M- Word-data saved to `{filename}`')
+    print(f'M- Word-data saved to `{filename}`')
+
+    return {
+        'rows': rows,
+        'vocabulary': vocabulary,
+        'site_words': list(site_words.values()),
+        'site_counts': list(site_counts.values())
+    }
+
+
+###--------------------------------->>>>>>>
+# heap merge of the shards' site-data by Website, rows are copied as written except for DuplicateOf,
+# which is taken from duplicates (mergeDuplicates()) when the shards' signatures were compared again
+# returns how many of the rows are near-duplicates (a DuplicateOf value)
+def mergeSiteData(site_files, filename, duplicates=None):
+    inputs = [open(site_file, 'r', newline='', encoding='utf-8') for site_file in site_files if site_file]
+    near_duplicates = 0
+
+    try:
+        readers = [csv.reader(file) for file in inputs]
+        header = None
+        for reader in readers:
+            header = next(reader, None) or header
+
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output, lineterminator='\n')
+            if header:
+                writer.writerow(header)
+
+            # the near-duplicate pages are counted on the way through, the summary does not re-read the column
+            duplicate_column = header.index('DuplicateOf') if header and 'DuplicateOf' in header else None
+            for row in heapq.merge(*readers, key=lambda row: row[0]):
+                if duplicates is not None and duplicate_column is not None:
+                    row[duplicate_column] = duplicates.get(row[0], '')
+                writer.writerow(row)
+                if duplicate_column is not None and len(row) > duplicate_column and row[duplicate_column]:
+                    near_duplicates += 1
+
+    finally:
+        for file in inputs:
+            file.close()
+
+    log.info(f'M- Site-data saved to `{filename}`')
+    print(f'M- Site-data saved to `{filename}`')
+    return near_duplicates
+
+
+###--------------------------------->>>>>>>
+# near-duplicates across the shards of the merged run: each shard only compared its own pages, here the
+# signatures every shard saved for its run (signature_runs: [(shard's signature file, run)]) are compared
+# again with each other and with the canonical pages of all shards' earlier runs; the shards' signature
+# files are updated with the result, so their next runs compare with the same canonical pages
+# returns {website: canonical website}, None when the shards kept no signatures of these runs
+def mergeDuplicates(signature_runs):
+    stores = [(SignatureStore(filename), run) for filename, run in signature_runs if os.path.exists(filename)]
+    signatures = {}
+    previous = {}
+
+    try:
+        shard_signatures = [store.runSignatures(run) for store, run in stores]
+
+        for (store, _), run_signatures in zip(stores, shard_signatures):
+            signatures.update(run_signatures)
+            previous.update(store.load())
+
+        if not signatures:
+            return None
+
+        duplicates = findDuplicates(signatures, previous)
+        for (store, run), run_signatures in zip(stores, shard_signatures):
+            store.save(run_signatures, duplicates, run)
+
+    finally:
+        for store, _ in stores:
+            store.close()
+
+    log.info(f'M- Found {len(duplicates)} near-duplicate pages among {len(signatures)} pages of {len(stores)} shards')
+    print(f'M- Found {len(duplicates)} near-duplicate pages among {len(signatures)} pages of {len(stores)} shards')
+    return duplicates
+
+
+###--------------------------------->>>>>>>
+# heap merge of the shards' institution-words by (Institution, Word), an institution whose domains
+# fell in several shards gets one row per word with the shards' counts added up
+def mergeInstitutionWords(word_files, filename):
+    inputs = [open(word_file, 'r', newline='', encoding='utf-8') for word_file in word_files if word_file]
+
+    try:
+        readers = [csv.reader(file) for file in inputs]
+        for reader in readers:
+            next(reader, None)
+
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow(['Institution', 'Word', 'Count'])
+
+            rows = heapq.merge(*readers, key=lambda row: (row[0], row[1]))
+            for (institution, word), group in groupby(rows, key=lambda row: (row[0], row[1])):
+                writer.writerow([institution, word, sum(int(row[2]) for row in group)])
+
+    finally:
+        for file in inputs:
+            file.close()
+
+    log.info(f'M- Institution-words saved to `{filename}`')
+    print(f'M- Institution-words saved to `{filename}`')
+
+
+###--------------------------------->>>>>>>
+# heap merge of the shards' institution-data by Institution, the page and tag counts of an institution
+# found in several shards are added up, its Category, State and City are the first shard's
+def mergeInstitutionData(data_files, filename):
+    inputs = [open(data_file, 'r', newline='', encoding='utf-8') for data_file in data_files if data_file]
+    counted = range(INSTITUTION_DATA_COLUMNS.index('PageCount'), len(INSTITUTION_DATA_COLUMNS))
+
+    try:
+        readers = [csv.reader(file) for file in inputs]
+        for reader in readers:
+            next(reader, None)
+
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow(INSTITUTION_DATA_COLUMNS)
+
+            for _, group in groupby(heapq.merge(*readers, key=lambda row: row[0]), key=lambda row: row[0]):
+                merged = next(group)
+                for row in group:
+                    for column in counted:
+                        merged[column] = int(merged[column]) + int(row[column])
+                writer.writerow(merged)
+
+    finally:
+        for file in inputs:
+            file.close()
+
+    log.info(f'M- Institution-data saved to `{filename}`')
+    print(f'M- Institution-data saved to `{filename}`')
+
+
+###--------------------------------->>>>>>>
+# merges the shards' log-data by timestamp, each row tagged with the shard it came from
+def mergeLogData(log_files, filename):
+    inputs = [(shard, open(log_file, 'r', newline='', encoding='utf-8')) for shard, log_file in log_files if log_file]
+
+    try:
+        readers = [tagRows(csv.DictReader(file), shard) for shard, file in inputs]
+
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.DictWriter(output, fieldnames=LOG_FIELDS + ['Shard'])
+            writer.writeheader()
+            writer.writerows(heapq.merge(*readers, key=lambda row: row['Timestamp']))
+
+    finally:
+        for _, file in inputs:
+            file.close()
+
+
+###--------------------------------->>>>>>>
+#
+def tagRows(reader, shard):
+
+    for row in reader:
+        row['Shard'] = shard
+        yield row
+
+
+###--------------------------------->>>>>>>
+# run time spans the shards (earliest start, latest end), cache metrics are summed
+def mergeShardSummaries(summary_files, runtime):
+    summaries = []
+
+    for summary_file in summary_files:
+        if summary_file:
+            with open(summary_file, 'r', encoding='utf-8') as file:
+                summaries.append(json.load(file))
+
+    if not summaries:
+        return
+
+    runtime.recordRunTime(
+        min(summary['run_time']['StartTime'] for summary in summaries),
+        max(summary['run_time']['EndTime'] for summary in summaries)
+    )
+
+    cache_metrics = Counter()
+    for summary in summaries:
+        cache_metrics.update(summary.get('cache_metrics', {}))
+
+    runtime.recordRobotsCache({
+        'hits': cache_metrics['RobotsCacheHits'],
+        'misses': cache_metrics['RobotsCacheMisses'],
+        'domains': cache_metrics['RobotsCacheDomains']
+    })
+    runtime.recordFetchCache({
+        'served': cache_metrics['UrlsServedFromCache'],
+        'misses': cache_metrics['UrlsParsed']
+    })
+
+
+###--------------------------------->>>>>>>
+# adds up the shards' raw counters and histogram buckets, percentiles are computed over all URLs
+def mergeEventMetrics(metrics_files):
+    merged = metrics.Metrics()
+
+    for metrics_file in metrics_files:
+        if metrics_file:
+            with open(metrics_file, 'r', encoding='utf-8') as file:
+                merged.merge(json.load(file))
+
+    return merged.snapshot()
+
+
+###--------------------------------->>>>>>>
+# writes a shard's raw event metrics next to its outputs, for mergeEventMetrics()
+def writeEventMetrics(output_dir, timestamp):
+    filename = os.path.join(output_dir, f'{timestamp}-event-metrics.json')
+
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(metrics.export(), file)
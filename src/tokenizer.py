@@ -0,0 +1,49 @@
+from collections import Counter
+import re
+import unicodedata
+
+NORMALIZATION = 'legacy'
+STRIP_CHARS = '.,!?'
+WORD_PATTERN = re.compile(r"[^\W_]+(?:['’\-][^\W_]+|(?<=\d)[.,]\d+)*")
+
+###--------------------------------->>>>>>>
+# counts the words of a page's text content under a normalization policy
+#   'legacy'    whitespace tokens, lower-cased, stripped of .,!?  (word-data.csv as it has always been)
+#   'unicode'   NFKC + casefold, tokens are runs of Unicode letters/digits joined by ' ’ or -,
+#               digit groups keep their separators (1,000  3.5)
+def countWords(text, policy=NORMALIZATION):
+
+    if policy == 'legacy':
+        return countLegacyWords(text)
+
+    if policy == 'unicode':
+        return countUnicodeWords(text)
+
+    raise ValueError(f'Unknown word normalization policy: {policy}')
+
+
+###--------------------------------->>>>>>>
+# batched count: every raw token is counted once by Counter in C, then only the
+# distinct tokens are stripped and folded together, into a plain dict (a Counter's += goes
+# through __missing__ in Python for every new word, which cost more than the strip on real pages)
+def countLegacyWords(text):
+    raw_count = Counter(text.lower().split())
+    word_count = {}
+    get = word_count.get
+
+    for token, count in raw_count.items():
+        word = token.strip(STRIP_CHARS)
+        word_count[word] = get(word, 0) + count
+
+    return word_count
+
+
+###--------------------------------->>>>>>>
+# one compiled-regex pass over the normalized text
+def countUnicodeWords(text):
+
+    if not unicodedata.is_normalized('NFKC', text):
+        text = unicodedata.normalize('NFKC', text)
+
+    text = text.casefold()
+    return Counter(WORD_PATTERN.findall(text))
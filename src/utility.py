@@ -1,11 +1,51 @@
-from datetime import datetime
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
 import csv
 import glob as bolg
+from importlib import metadata
 import logging as log
+import metrics
 import os
-import pandas as pd
 import shutil
 import subprocess
+import tempfile
+import threading
+from vocabulary import Vocabulary
+
+SITE_DATA_COLUMNS = [
+    'Website',
+    'Institution',
+    'Category',
+    'State',
+    'City',
+    'ImageCount',
+    'LinkCount',
+    'FormCount',
+    'StylesheetCount',
+    'ScriptCount',
+    'CertificateInfo',
+    'HostInfo',
+    'Title',
+    'Description',
+    'FetchStatus',
+    'DuplicateOf'
+]
+INSTITUTION_DATA_COLUMNS = [
+    'Institution',
+    'Category',
+    'State',
+    'City',
+    'PageCount',
+    'ImageCount',
+    'LinkCount',
+    'FormCount',
+    'StylesheetCount',
+    'ScriptCount'
+]
+
+_timestamps = set()
+_timestamps_lock = threading.Lock()
 
 ###--------------------------------->>>>>>>
 # verify data directories and input file exist, create data directories and copy backup input if !exists
@@ -23,14 +63,20 @@ def setupProjectStructure(LOG_FILE):
         log.error(f'U- Failed to clear log file: {e}')
         print(f'U- Failed to clear log file: {e}')
 
-    # try:
-    #     with open(os.devnull, 'w') as devnull:
-    #         subprocess.check_call([
-    #                 os.sys.executable,
-    #                 '-m', 'pip', 'install', '-r', 'requirements.txt'],
-    #                 stdout=devnull,
-    #                 stderr=devnull
-    #         )
+    # installed versions are read from package metadata, pip only runs when something is missing or differs
+    unmet = checkRequirements()
+
+    if unmet is None:
+        return
+
+    if not unmet:
+        log.info('U- All requirements are met')
+        print('All requirements are met, for details check: logs/scraper.log')
+        return
+
+    for name, required, installed in unmet:
+        log.warning(f'U- Requirement {name}=={required} not met, installed: {installed}')
+
     try:
         result = subprocess.run(
             [os.sys.executable, '-m', 'pip', 'install', '-r', 'requirements.txt'],
@@ -58,143 +104,386 @@ def setupProjectStructure(LOG_FILE):
 
 
 ###--------------------------------->>>>>>>
-# read URLs from CSV input file
-def readDataInput(filename='data/input/url-list.csv'):
-    url_list = {}
+# compares requirements.txt pins with the installed distributions, without starting pip
+# returns [(name, required version, installed version or None)] for every unmet requirement,
+# None when the requirements file cannot be read (logged, the run goes on with what is installed)
+def checkRequirements(filename='requirements.txt'):
+    unmet = []
 
     try:
-        with open(filename, mode='r') as file:
-            reader = csv.DictReader(file)
-
-            # for row in reader:
-            #     url_list[row['Institution']] = row['Website']
-
-            for row in reader:
-                ##log.info(f"Row data: {row}")
-                url_list[row['Website']] = {
-                    'Category': row['Category'],
-                    'State': row['State'],
-                    'City': row['City'],
-                    'Institution': row['Institution']
-                }
-
-        log.info(f'U- URLs loaded from `{filename}`')
-        print(f'U- URLs loaded from `{filename}`')
-        
-    except Exception as e:
-        log.error(f'U- Error loading URLs from `{filename}`: {e}')
-        print((f'U- Error loading URLs from `{filename}`: {e}'))
+        with open(filename, 'r') as file:
+            for line in file:
+                requirement = line.split('#', 1)[0].strip()
+                if not requirement:
+                    continue
+
+                name, _, required = requirement.partition('==')
+                name, required = name.strip(), required.strip() or None
+
+                try:
+                    installed = metadata.version(name)
+                except metadata.PackageNotFoundError:
+                    installed = None
+
+                if installed is None or (required and installed != required):
+                    unmet.append((name, required, installed))
+
+    except OSError as e:
+        log.error(f'U- Could not read requirements from {filename}: {e}')
+        print(f'U- Could not read requirements from {filename}, for details check: logs/scraper.log')
+        return None
 
-    return url_list
+    return unmet
+
+
+###--------------------------------->>>>>>>
+# run timestamp of a job, to the second: a timestamp another job of this process already took for
+# the same output_dir, or that already names files there, moves on to the next second
+# the writers below claim one when called without the job's timestamp, so a run's files share one name
+# only when the caller passes it to each of them
+def claimTimestamp(output_dir):
+    moment = datetime.now()
+
+    with _timestamps_lock:
+        while True:
+            timestamp = moment.strftime("%Y%m%d-%H%M%S")
+            claim = (os.path.abspath(output_dir) if output_dir else None, timestamp)
+
+            if claim not in _timestamps and not (output_dir and bolg.glob(os.path.join(output_dir, f'{timestamp}-*'))):
+                _timestamps.add(claim)
+                return timestamp
+
+            moment += timedelta(seconds=1)
+
+
+###--------------------------------->>>>>>>
+# read URLs from CSV input file into a dict keyed by normalized URL, see inputreader.readUrlInput
+def readDataInput(filename='data/input/url-list.csv'):
+    from inputreader import readUrlInput
+    return dict(readUrlInput(filename))
 
 
 ###--------------------------------->>>>>>>
 # write word count data to CSV file
-def writeWordData(data, filename='data/output/word-data.csv'):
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M")
-    base, ext = os.path.splitext(os.path.basename(filename))
-    directory = os.path.dirname(filename)
-    filename = f"{directory}/{timestamp}-{base}{ext}"
+def writeWordData(data, filename='data/output/word-data.csv', formats=('csv',), timestamp=None):
+    word_writer = WordDataWriter(filename, formats, timestamp)
 
-    try:
-        with open(filename, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([
-                'Website',
-                'Word',
-                'Count'
-            ])
-
-            for website, word_data in data.items():
-                for word, count in word_data.items():
-                    writer.writerow([
-                        website,
-                        word,
-                        count
-                    ])
-
-        log.info(f'U- Word-data saved to `{filename}`')
-        print(f'U- Word-data saved to `{filename}`')
-    
-    except Exception as e:
-        log.error(f'U- Error saving word-data to `{filename}`: {e}')
-        print(f'U- Error saving word-data to `{filename}`: {e}')
+    for website, word_data in data.items():
+        word_writer.writeSite(website, word_data)
+
+    word_writer.close()
+
+
+###--------------------------------->>>>>>>
+# streams word-data one site at a time: each finished site is interned into the run's Vocabulary
+# and spilled to a temporary file as (word_id, count) arrays, close() decodes the sites in
+# (Website, Word) order; memory stays bounded by the vocabulary plus a (website, offset, length)
+# index entry per site, and no word string is stored more than once
+# formats: 'csv' and/or 'parquet' (dictionary-encoded, compressed, see columnar.py)
+# word metrics for the diagnostic summary are accumulated while the rows go by, see stats()
+# key_column names the first column; with combine=True the counts of a key written several times
+# are added up into one row per word (institution-words), otherwise each write keeps its rows
+class WordDataWriter:
+
+    def __init__(self, filename='data/output/word-data.csv', formats=('csv',), timestamp=None,
+                 key_column='Website', combine=False):
+        base, ext = os.path.splitext(os.path.basename(filename))
+        directory = os.path.dirname(filename)
+        timestamp = timestamp or claimTimestamp(directory)
+        self.filename = f"{directory}/{timestamp}-{base}{ext}"
+        self.parquet_filename = f"{directory}/{timestamp}-{base}.parquet"
+        self.timestamp = timestamp
+        self.formats = formats
+        self.key_column = key_column
+        self.combine = combine
+        self.spill = tempfile.TemporaryFile()
+        self.runs = []
+        self.vocabulary = Vocabulary()
+        self.site_words = Counter()
+        self.site_counts = Counter()
+
+
+    ###--------------------------------->>>>>>>
+    # spills one site's words as an id array followed by a count array, as soon as the site finishes
+    def writeSite(self, website, word_data):
+        word_ids, counts = self.vocabulary.encode(word_data)
+
+        metrics.increment('sites_written')
+        metrics.increment('word_rows_written', len(word_data))
+        self.site_words[website] += len(word_data)
+        self.site_counts[website] += sum(counts)
+
+        self.spill.seek(0, os.SEEK_END)
+        self.runs.append((website, self.spill.tell(), len(word_ids)))
+        word_ids.tofile(self.spill)
+        counts.tofile(self.spill)
+
+
+    ###--------------------------------->>>>>>>
+    # streams the decoded sites to each selected output format, returns the files written
+    def close(self):
+        csv_file = None
+        parquet_writer = None
+        written = []
+
+        try:
+            if 'csv' in self.formats:
+                csv_file = open(self.filename, mode='w', newline='', encoding='utf-8')
+                csv_writer = csv.writer(csv_file, lineterminator='\n')
+                csv_writer.writerow([self.key_column, 'Word', 'Count'])
+
+            if 'parquet' in self.formats:
+                from columnar import WordParquetWriter
+                parquet_writer = WordParquetWriter(self.parquet_filename, self.key_column)
+
+            with metrics.timer('word_merge'):
+                for rows in self.decodedSites():
+                    if csv_file:
+                        csv_writer.writerows(rows)
+                    if parquet_writer:
+                        parquet_writer.writeRows(rows)
+
+            if csv_file:
+                csv_file.close()
+                written.append(self.filename)
+                log.info(f'U- Word-data saved to `{self.filename}`')
+                print(f'U- Word-data saved to `{self.filename}`')
+
+            if parquet_writer:
+                parquet_writer.close()
+                written.append(self.parquet_filename)
+
+        except Exception as e:
+            log.error(f'U- Error saving word-data to `{self.filename}`: {e}')
+            print(f'U- Error saving word-data to `{self.filename}`: {e}')
+
+        finally:
+            if csv_file:
+                csv_file.close()
+            self.spill.close()
+
+        return written
+
+
+    ###--------------------------------->>>>>>>
+    # leaves the given websites out of the output, and out of the word metrics, before close()
+    def dropSites(self, websites):
+        websites = set(websites)
+        if not websites:
+            return
+
+        kept = []
+        for run in self.runs:
+
+            if run[0] not in websites:
+                kept.append(run)
+                continue
+
+            for word_id, count in self.readRun(run):
+                self.vocabulary.totals[word_id] -= count
+
+        self.runs = kept
+        for website in websites:
+            self.site_words.pop(website, None)
+            self.site_counts.pop(website, None)
+
+        metrics.increment('sites_collapsed', len(websites))
+
+
+    ###--------------------------------->>>>>>>
+    # word metrics of everything written so far: word totals across sites, and per site
+    # the number of word rows and the sum of their counts
+    def stats(self):
+        return {
+            'rows': sum(self.site_words.values()),
+            'vocabulary': self.vocabulary,
+            'site_words': list(self.site_words.values()),
+            'site_counts': list(self.site_counts.values())
+        }
+
+
+    ###--------------------------------->>>>>>>
+    # yields each site's [website, word, count] rows in website order, words sorted by their
+    # precomputed rank; repeated runs of the same site keep their order for equal words
+    def decodedSites(self):
+        self.runs.sort(key=lambda run: run[0])
+        ranks = self.vocabulary.ranks()
+        decode = self.vocabulary.decode
+        position = 0
+
+        while position < len(self.runs):
+            website = self.runs[position][0]
+            pairs = []
+
+            while position < len(self.runs) and self.runs[position][0] == website:
+                pairs.extend(self.readRun(self.runs[position]))
+                position += 1
+
+            if self.combine:
+                totals = Counter()
+                for word_id, count in pairs:
+                    totals[word_id] += count
+                pairs = list(totals.items())
+
+            pairs.sort(key=lambda pair: ranks[pair[0]])
+            yield [[website, decode(word_id), count] for word_id, count in pairs]
+
+
+    ###--------------------------------->>>>>>>
+    # (word_id, count) pairs of one spilled site
+    def readRun(self, run):
+        _, offset, length = run
+        word_ids = array('I')
+        counts = array('q')
+
+        self.spill.seek(offset)
+        word_ids.fromfile(self.spill, length)
+        counts.fromfile(self.spill, length)
+
+        return zip(word_ids, counts)
         
 
 ###--------------------------------->>>>>>>
-# write site details data to CSV file
-def writeSiteData(data, filename='data/output/site-data.csv'):
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M")
+# write site details data to CSV and/or Parquet file
+def writeSiteData(data, filename='data/output/site-data.csv', formats=('csv',), timestamp=None):
+    rows = [[
+        website,
+        site_data['Institution'],
+        site_data['Category'],
+        site_data['State'],
+        site_data['City'],
+        site_data['images'],
+        site_data['links'],
+        site_data['forms'],
+        site_data['stylesheets'],
+        site_data['scripts'],
+        site_data['cert'],
+        site_data['host'],
+        site_data['title'],
+        site_data['description'],
+        site_data.get('status', 'ok'),
+        site_data.get('duplicate_of') or '',
+    ] for website, site_data in data.items()]
+
+    return writeTable(rows, SITE_DATA_COLUMNS, 'Site-data', filename, formats, timestamp)
+
+
+###--------------------------------->>>>>>>
+# per-institution totals of a link-following crawl: pages crawled and their summed tag counts,
+# location fields are taken from the institution's first page; rows in Institution order
+def writeInstitutionData(data, filename='data/output/institution-data.csv', formats=('csv',), timestamp=None):
+    institutions = {}
+
+    for site_data in data.values():
+        totals = institutions.get(site_data['Institution'])
+
+        if totals is None:
+            totals = institutions[site_data['Institution']] = [
+                site_data['Institution'],
+                site_data['Category'],
+                site_data['State'],
+                site_data['City'],
+                0, 0, 0, 0, 0, 0
+            ]
+
+        totals[4] += 1
+        for column, field in enumerate(('images', 'links', 'forms', 'stylesheets', 'scripts'), start=5):
+            totals[column] += site_data[field]
+
+    rows = [institutions[institution] for institution in sorted(institutions)]
+    return writeTable(rows, INSTITUTION_DATA_COLUMNS, 'Institution-data', filename, formats, timestamp)
+
+
+###--------------------------------->>>>>>>
+# writes rows to a timestamped CSV and/or Parquet file, kind names the file in log messages
+# returns the files written
+def writeTable(rows, columns, kind, filename, formats=('csv',), timestamp=None):
     base, ext = os.path.splitext(os.path.basename(filename))
     directory = os.path.dirname(filename)
+    timestamp = timestamp or claimTimestamp(directory)
     filename = f"{directory}/{timestamp}-{base}{ext}"
+    parquet_filename = f"{directory}/{timestamp}-{base}.parquet"
+    written = []
 
-    try:
-        with open(filename, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([
-                'Website',
-                'Institution',
-                'Category',
-                'State',
-                'City',
-                'ImageCount',
-                'LinkCount',
-                'FormCount',
-                'StylesheetCount',
-                'ScriptCount',
-                'CertificateInfo',
-                'HostInfo',
-                'Title',
-                'Description'
-            ])
-
-            for website, site_data in data.items():
-                writer.writerow([
-                    website,
-                    site_data['Institution'],
-                    site_data['Category'],
-                    site_data['State'],
-                    site_data['City'],
-                    site_data['images'],
-                    site_data['links'],
-                    site_data['forms'],
-                    site_data['stylesheets'],
-                    site_data['scripts'],
-                    site_data['cert'],
-                    site_data['host'],
-                    site_data['title'],
-                    site_data['description'],
-                ])
-
-        log.info(f'U- Site-data saved to `{filename}`')
-        print(f'U- Site-data saved to `{filename}`')
+    if 'csv' in formats:
 
-    except Exception as e:
-        log.error(f'U- Error saving site-data to `{filename}`: {e}')
-        print(f'U- Error saving site-data to `{filename}`: {e}')
+        try:
+            with open(filename, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                writer.writerows(rows)
+
+            written.append(filename)
+            log.info(f'U- {kind} saved to `{filename}`')
+            print(f'U- {kind} saved to `{filename}`')
+
+        except Exception as e:
+            log.error(f'U- Error saving {kind.lower()} to `{filename}`: {e}')
+            print(f'U- Error saving {kind.lower()} to `{filename}`: {e}')
+
+    if 'parquet' in formats:
+
+        try:
+            import pandas as pd
+            frame = pd.DataFrame(rows, columns=columns)
+            writeDataFile(frame, parquet_filename)
+            written.append(parquet_filename)
+
+            log.info(f'U- {kind} saved to `{parquet_filename}`')
+            print(f'U- {kind} saved to `{parquet_filename}`')
+
+        except Exception as e:
+            log.error(f'U- Error saving {kind.lower()} to `{parquet_filename}`: {e}')
+            print(f'U- Error saving {kind.lower()} to `{parquet_filename}`: {e}')
+
+    return written
+
+
+###--------------------------------->>>>>>>
+# reads a CSV or Parquet data output file into a DataFrame
+# pandas is imported here rather than at startup, it is only needed once the crawl is done
+def readDataFile(filename):
+    import pandas as pd
+
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename)
+
+    return pd.read_csv(filename)
 
 
 ###--------------------------------->>>>>>>
-# sorts the datafiles after writing
+# writes a DataFrame back in the file's own format
+def writeDataFile(frame, filename):
 
+    if filename.endswith('.parquet'):
+        from columnar import COMPRESSION
+        frame.to_parquet(filename, compression=COMPRESSION, index=False)
+    else:
+        frame.to_csv(filename, index=False)
+
+
+###--------------------------------->>>>>>>
+# sorts a CSV or Parquet data output file in place by the given columns
+def sortDataFile(filename, columns, kind='Data'):
+    data = readDataFile(filename)
+    writeDataFile(data.sort_values(by=columns), filename)
+    log.info(f'U- Sorted {kind.lower()} saved to `{filename}`')
+    print(f'U- Sorted {kind.lower()} saved to `{filename}`')
+
+
+###--------------------------------->>>>>>>
+# sorts the newest data files matching the patterns, patterns may match *.csv or *.parquet files
+# word-data written by WordDataWriter is already sorted, pass None to skip it
+# the pipeline sorts the files it wrote with sortDataFile(), this is for outputs found by name
 def sortDataOutput(word_data_pattern, site_data_pattern):
-    word_data_files = bolg.glob(word_data_pattern)
+    word_data_files = bolg.glob(word_data_pattern) if word_data_pattern else []
     latest_word_file = max(word_data_files, key=os.path.getctime) if word_data_files else None
 
     site_data_files = bolg.glob(site_data_pattern)
     latest_site_file = max(site_data_files, key=os.path.getctime) if site_data_files else None
 
     if latest_word_file:
-        word_data = pd.read_csv(latest_word_file)
-        sorted_word_data = word_data.sort_values(by=['Website', 'Word'])
-        sorted_word_data.to_csv(latest_word_file, index=False)
-        log.info(f'U- Sorted word-data saved to `{latest_word_file}`')
-        print(f'U- Sorted word-data saved to `{latest_word_file}`')
+        sortDataFile(latest_word_file, ['Website', 'Word'], 'Word-data')
 
     if latest_site_file:
-        site_data = pd.read_csv(latest_site_file)
-        sorted_site_data = site_data.sort_values(by=['Website'])
-        sorted_site_data.to_csv(latest_site_file, index=False)
-        log.info(f'U- Sorted site-data saved to `{latest_site_file}`')
-        print(f'U- Sorted site-data saved to `{latest_site_file}`')
\ No newline at end of file
+        sortDataFile(latest_site_file, ['Website'], 'Site-data')
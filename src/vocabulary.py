@@ -0,0 +1,69 @@
+from array import array
+
+###--------------------------------->>>>>>>
+# run-wide word interning: each distinct word is stored once and gets an integer id,
+# sites are kept as compact (word_id, count) arrays and decoded only when word-data is written
+# also keeps every word's total count across sites for the diagnostic summary
+class Vocabulary:
+
+    def __init__(self):
+        self.ids = {}
+        self.words = []
+        self.totals = array('q')
+
+
+    ###--------------------------------->>>>>>>
+    # interns a site's {word: count} and returns it as parallel id and count arrays
+    def encode(self, word_data):
+        word_ids = array('I')
+        counts = array('q')
+
+        for word, count in word_data.items():
+            word_id = self.ids.get(word)
+
+            if word_id is None:
+                word_id = len(self.words)
+                self.ids[word] = word_id
+                self.words.append(word)
+                self.totals.append(0)
+
+            self.totals[word_id] += count
+            word_ids.append(word_id)
+            counts.append(count)
+
+        return word_ids, counts
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def decode(self, word_id):
+        return self.words[word_id]
+
+
+    ###--------------------------------->>>>>>>
+    # position of every word id in sorted word order, sorts a site's ids without comparing strings
+    def ranks(self):
+        ranks = array('I', bytes(4 * len(self.words)))
+
+        for rank, word_id in enumerate(sorted(range(len(self.words)), key=self.words.__getitem__)):
+            ranks[word_id] = rank
+
+        return ranks
+
+
+    ###--------------------------------->>>>>>>
+    # (word, total count) pairs, read like Counter.items() by Diagnostics
+    def items(self):
+        return ((word, total) for word, total in zip(self.words, self.totals) if total)
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def values(self):
+        return self.totals
+
+
+    ###--------------------------------->>>>>>>
+    # words still counted: a word only written by sites dropped from word-data has a total of 0
+    def __len__(self):
+        return sum(1 for total in self.totals if total)
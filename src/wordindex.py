@@ -0,0 +1,366 @@
+"""
+Cross-run word index: every run's word-data in one SQLite file, queried without reading any CSV.
+
+COMMAND:        python src/wordindex.py add data/output/*-word-data.csv
+                python src/wordindex.py runs
+                python src/wordindex.py top [-n 25] [--run 20241018-093015]
+                python src/wordindex.py word WORD [--run ...] [-n 25]
+                python src/wordindex.py site URL [--run ...] [-n 25]
+                python src/wordindex.py diff RUN_A RUN_B [--site URL] [-n 25]
+                runs are named by their output timestamp, --run defaults to the latest run
+"""
+import argparse
+import csv
+import logging as log
+import os
+import sqlite3
+import time
+
+WORD_INDEX_FILE = 'data/index/word-index.sqlite'
+INSERT_BATCH = 50_000
+TOP_WORDS = 25
+
+###--------------------------------->>>>>>>
+# word -> (site, run, count) store of every indexed run: words and sites are interned to integer ids,
+# counts are keyed (run, site, word) in a WITHOUT ROWID table, so a site's vocabulary is one range scan,
+# and a (word, run, count) index answers which sites use a word; per-run word totals are kept
+# in run_totals when a run is added, top-N and run diffs read them instead of the site rows
+class WordIndex:
+
+    def __init__(self, filename=WORD_INDEX_FILE):
+        self.filename = filename
+
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY,
+                timestamp TEXT UNIQUE,
+                source TEXT,
+                rows INTEGER,
+                sites INTEGER,
+                indexed REAL
+            );
+            CREATE TABLE IF NOT EXISTS words (
+                word_id INTEGER PRIMARY KEY,
+                word TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS sites (
+                site_id INTEGER PRIMARY KEY,
+                website TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS counts (
+                run_id INTEGER,
+                site_id INTEGER,
+                word_id INTEGER,
+                count INTEGER,
+                PRIMARY KEY (run_id, site_id, word_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS counts_by_word ON counts (word_id, run_id, count);
+            CREATE TABLE IF NOT EXISTS run_totals (
+                run_id INTEGER,
+                word_id INTEGER,
+                total INTEGER,
+                sites INTEGER,
+                PRIMARY KEY (run_id, word_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS run_totals_by_total ON run_totals (run_id, total);
+        ''')
+        self.connection.commit()
+
+
+    ###--------------------------------->>>>>>>
+    # loads a word-data CSV or Parquet file as the run named by its timestamp, replacing an earlier
+    # load of the same run; rows are streamed and inserted in batches of INSERT_BATCH
+    def addRun(self, filename, timestamp=None):
+        timestamp = timestamp or runTimestamp(filename)
+        started = time.perf_counter()
+
+        with self.connection:
+            self.dropRun(timestamp)
+            run_id = self.connection.execute(
+                'INSERT INTO runs (timestamp, source, rows, sites, indexed) VALUES (?, ?, 0, 0, ?)',
+                (timestamp, filename, time.time())
+            ).lastrowid
+
+            word_ids = self.internTable('words')
+            site_ids = self.internTable('sites')
+            batch = []
+            rows = 0
+
+            for website, word, count in readWordRows(filename):
+                batch.append((run_id, self.intern(site_ids, 'sites', website), self.intern(word_ids, 'words', word), count))
+
+                if len(batch) >= INSERT_BATCH:
+                    rows += self.insertCounts(batch)
+                    batch = []
+
+            rows += self.insertCounts(batch)
+
+            self.connection.execute('''
+                INSERT INTO run_totals
+                SELECT run_id, word_id, SUM(count), COUNT(*) FROM counts WHERE run_id = ? GROUP BY word_id
+            ''', (run_id,))
+            self.connection.execute('''
+                UPDATE runs SET rows = ?, sites = (SELECT COUNT(DISTINCT site_id) FROM counts WHERE run_id = ?)
+                WHERE run_id = ?
+            ''', (rows, run_id, run_id))
+
+        log.info(f'I- Indexed {rows} word rows of run {timestamp} from `{filename}` '
+                 f'in {time.perf_counter() - started:.1f} s')
+        print(f'I- Indexed {rows} word rows of run {timestamp} from `{filename}`')
+        return timestamp
+
+
+    ###--------------------------------->>>>>>>
+    # a site written more than once in a run (word-data keeps each write) gets its counts added up
+    def insertCounts(self, batch):
+        self.connection.executemany('''
+            INSERT INTO counts VALUES (?, ?, ?, ?)
+            ON CONFLICT (run_id, site_id, word_id) DO UPDATE SET count = count + excluded.count
+        ''', batch)
+        return len(batch)
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def dropRun(self, timestamp):
+        row = self.connection.execute('SELECT run_id FROM runs WHERE timestamp = ?', (timestamp,)).fetchone()
+
+        if row is None:
+            return
+
+        for table in ('counts', 'run_totals', 'runs'):
+            self.connection.execute(f'DELETE FROM {table} WHERE run_id = ?', row)
+
+
+    ###--------------------------------->>>>>>>
+    # {value: id} of an interning table, read once per load
+    def internTable(self, table):
+        return {value: value_id for value_id, value in self.connection.execute(f'SELECT * FROM {table}')}
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def intern(self, ids, table, value):
+        value_id = ids.get(value)
+
+        if value_id is None:
+            value_id = ids[value] = len(ids) + 1
+            self.connection.execute(f'INSERT INTO {table} VALUES (?, ?)', (value_id, value))
+
+        return value_id
+
+
+    ###--------------------------------->>>>>>>
+    # [(timestamp, word rows, sites, source file)] of every indexed run, oldest first
+    def runs(self):
+        return self.connection.execute('SELECT timestamp, rows, sites, source FROM runs ORDER BY timestamp').fetchall()
+
+
+    ###--------------------------------->>>>>>>
+    # run_id of a run timestamp, the latest run when None; raises KeyError for a run that is not indexed
+    def runId(self, timestamp=None):
+
+        if timestamp is None:
+            row = self.connection.execute('SELECT run_id FROM runs ORDER BY timestamp DESC LIMIT 1').fetchone()
+        else:
+            row = self.connection.execute('SELECT run_id FROM runs WHERE timestamp = ?', (timestamp,)).fetchone()
+
+        if row is None:
+            raise KeyError(f'run {timestamp or "(latest)"} is not in the word index')
+
+        return row[0]
+
+
+    ###--------------------------------->>>>>>>
+    # [(word, total count, sites using it)] of the n most frequent words of a run
+    def topWords(self, timestamp=None, n=TOP_WORDS):
+        return self.connection.execute('''
+            SELECT word, total, sites FROM run_totals JOIN words USING (word_id)
+            WHERE run_id = ? ORDER BY total DESC, word LIMIT ?
+        ''', (self.runId(timestamp), n)).fetchall()
+
+
+    ###--------------------------------->>>>>>>
+    # [(website, count)] of the n sites using a word most in a run
+    def wordSites(self, word, timestamp=None, n=TOP_WORDS):
+        return self.connection.execute('''
+            SELECT website, count FROM counts JOIN sites USING (site_id)
+            WHERE word_id = (SELECT word_id FROM words WHERE word = ?) AND run_id = ?
+            ORDER BY count DESC, website LIMIT ?
+        ''', (word, self.runId(timestamp), n)).fetchall()
+
+
+    ###--------------------------------->>>>>>>
+    # [(timestamp, total count, sites)] of a word in every run, oldest first; runs without it count 0
+    def wordHistory(self, word):
+        return self.connection.execute('''
+            SELECT timestamp, COALESCE(run_totals.total, 0), COALESCE(run_totals.sites, 0) FROM runs
+            LEFT JOIN run_totals ON run_totals.run_id = runs.run_id
+                AND run_totals.word_id = (SELECT word_id FROM words WHERE word = ?)
+            ORDER BY timestamp
+        ''', (word,)).fetchall()
+
+
+    ###--------------------------------->>>>>>>
+    # [(word, count)] of a site's vocabulary in a run, most frequent first, all words when n is None
+    def siteVocabulary(self, website, timestamp=None, n=None):
+        return self.connection.execute('''
+            SELECT word, count FROM counts JOIN words USING (word_id)
+            WHERE run_id = ? AND site_id = (SELECT site_id FROM sites WHERE website = ?)
+            ORDER BY count DESC, word LIMIT ?
+        ''', (self.runId(timestamp), website, -1 if n is None else n)).fetchall()
+
+
+    ###--------------------------------->>>>>>>
+    # word count changes from run a to run b, across all sites or for one website:
+    # {'added': words only in b, 'removed': words only in a,
+    #  'changes': [(word, count in a, count in b)] of the n largest changes}
+    def diffRuns(self, timestamp_a, timestamp_b, website=None, n=TOP_WORDS):
+        run_a, run_b = self.runId(timestamp_a), self.runId(timestamp_b)
+
+        if website is None:
+            counts = 'SELECT word_id, total AS count FROM run_totals WHERE run_id = ?'
+            parameters = (run_a, run_b)
+        else:
+            counts = 'SELECT word_id, count FROM counts WHERE run_id = ? AND site_id = (SELECT site_id FROM sites WHERE website = ?)'
+            parameters = (run_a, website, run_b, website)
+
+        pairs = f'''
+            SELECT word_id, SUM(before) AS before, SUM(after) AS after FROM (
+                SELECT word_id, count AS before, 0 AS after FROM ({counts})
+                UNION ALL
+                SELECT word_id, 0, count FROM ({counts})
+            ) GROUP BY word_id
+        '''
+        added, removed = self.connection.execute(
+            f'SELECT COALESCE(SUM(before = 0), 0), COALESCE(SUM(after = 0), 0) FROM ({pairs})', parameters
+        ).fetchone()
+        changes = self.connection.execute(f'''
+            SELECT word, before, after FROM ({pairs}) JOIN words USING (word_id)
+            WHERE before != after ORDER BY ABS(after - before) DESC, word LIMIT ?
+        ''', (*parameters, n)).fetchall()
+
+        return {'added': added, 'removed': removed, 'changes': changes}
+
+
+    ###--------------------------------->>>>>>>
+    #
+    def close(self):
+        self.connection.close()
+
+
+###--------------------------------->>>>>>>
+# run name of a data output file: data/output/20241018-093015-word-data.csv -> 20241018-093015
+def runTimestamp(filename):
+    return '-'.join(os.path.basename(filename).split('-')[:2])
+
+
+###--------------------------------->>>>>>>
+# streams (website, word, count) rows of a word-data CSV or Parquet file
+def readWordRows(filename):
+
+    if filename.endswith('.parquet'):
+        from columnar import iterParquetBatches
+
+        for batch in iterParquetBatches(filename, ['Website', 'Word', 'Count']):
+            yield from zip(*(column.to_pylist() for column in batch.columns))
+        return
+
+    with open(filename, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+
+        for website, word, count in reader:
+            yield website, word, int(count)
+
+
+###--------------------------------->>>>>>>
+# adds a finished run's word-data to the index, the Parquet copy is read when the run wrote both
+def indexRun(word_files, index_file=WORD_INDEX_FILE):
+
+    if not word_files:
+        return None
+
+    word_file = next((filename for filename in word_files if filename.endswith('.parquet')), word_files[0])
+    index = WordIndex(index_file)
+
+    try:
+        return index.addRun(word_file)
+
+    finally:
+        index.close()
+
+
+###--------------------------------->>>>>>>
+# prints query rows as aligned columns, followed by the query time
+def printRows(rows, headers, elapsed):
+    widths = [max([len(str(header))] + [len(str(row[column])) for row in rows]) for column, header in enumerate(headers)]
+
+    print('  '.join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+    print(f'({len(rows)} rows, {elapsed * 1000:.1f} ms)')
+
+
+###--------------------------------->>>>>>>
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Website Words cross-run word index')
+    parser.add_argument('--index', default=WORD_INDEX_FILE, help='index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='index word-data files, each as the run of its timestamp')
+    add.add_argument('files', nargs='+')
+    commands.add_parser('runs', help='list the indexed runs')
+    top = commands.add_parser('top', help='most frequent words of a run')
+    word = commands.add_parser('word', help='sites using a word in a run, and its totals in every run')
+    word.add_argument('word')
+    site = commands.add_parser('site', help="a site's vocabulary in a run")
+    site.add_argument('website')
+    diff = commands.add_parser('diff', help='largest word count changes between two runs')
+    diff.add_argument('run_a')
+    diff.add_argument('run_b')
+    diff.add_argument('--site', help='compare one website instead of the whole runs')
+
+    for command in (top, word, site, diff):
+        command.add_argument('-n', type=int, default=TOP_WORDS, help='rows to show')
+    for command in (top, word, site):
+        command.add_argument('--run', help='run timestamp, default: the latest run')
+
+    args = parser.parse_args()
+    index = WordIndex(args.index)
+    started = time.perf_counter()
+
+    try:
+        if args.command == 'add':
+            for filename in args.files:
+                index.addRun(filename)
+
+        elif args.command == 'runs':
+            printRows(index.runs(), ['Run', 'Rows', 'Sites', 'Source'], time.perf_counter() - started)
+
+        elif args.command == 'top':
+            printRows(index.topWords(args.run, args.n), ['Word', 'Count', 'Sites'], time.perf_counter() - started)
+
+        elif args.command == 'word':
+            printRows(index.wordSites(args.word, args.run, args.n), ['Website', 'Count'], time.perf_counter() - started)
+            started = time.perf_counter()
+            printRows(index.wordHistory(args.word), ['Run', 'Count', 'Sites'], time.perf_counter() - started)
+
+        elif args.command == 'site':
+            printRows(index.siteVocabulary(args.website, args.run, args.n), ['Word', 'Count'], time.perf_counter() - started)
+
+        elif args.command == 'diff':
+            result = index.diffRuns(args.run_a, args.run_b, args.site, args.n)
+            print(f'{result["added"]} words added, {result["removed"]} words removed')
+            printRows(result['changes'], ['Word', args.run_a, args.run_b], time.perf_counter() - started)
+
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    finally:
+        index.close()